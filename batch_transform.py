@@ -0,0 +1,311 @@
+"""Apply background image transforms to many .blend files.
+
+Usage:
+    python batch_transform.py JOB FILE [FILE ...] [--workers 4] [--dry-run]
+                              [--blender /path/to/blender] [--results out.json]
+                              [--backend blender|stand-in]
+
+Each file is processed by its own worker process: a background Blender
+opening the file, applying the job to the background images of all its 3D
+Views, and saving it if anything changed. With --dry-run, files are left
+untouched and the changes are only printed.
+
+The job is a JSON file with a list of rules, applied in order. Each rule
+matches background images by image name and file path (shell patterns) and
+view axis, and transforms them as transform_background_images() does:
+
+    {"rules": [
+        {"match": {"image": "plate_010*", "view_axis": "TOP"},
+         "offset": [0.0, 0.2], "rotation": 1.5, "scale": 1.02,
+         "pivot_point": "INDIVIDUAL_ORIGINS"}
+    ]}
+
+Rotations are in degrees, clockwise. Instead of offset, rotation and scale,
+a rule can give a 2x2 or 2x3 view space "matrix". Pivot points are 3D View
+pivot point modes, INDIVIDUAL_ORIGINS by default, with the 3D cursor given
+as "cursor", in view space.
+
+The stand-in backend processes JSON documents describing views and their
+background images instead of .blend files, with the stand-ins of
+benchmarks/stand_ins.py in place of Blender, to test jobs.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from math import radians
+
+
+RESULT_PREFIX = 'BATCH_TRANSFORM_RESULT '
+RULE_KEYS = {'match', 'offset', 'rotation', 'scale', 'matrix',
+             'pivot_point', 'cursor'}
+MATCH_KEYS = {'image', 'filepath', 'view_axis'}
+PIVOT_POINTS = ('BOUNDING_BOX_CENTER', 'CURSOR', 'INDIVIDUAL_ORIGINS',
+                'MEDIAN_POINT', 'ACTIVE_ELEMENT')
+
+
+def load_job(filepath):
+    """Read a job file, raising ValueError if it isn't valid"""
+    with open(filepath) as f:
+        job = json.load(f)
+    if not isinstance(job, dict) or not isinstance(job.get('rules'), list):
+        raise ValueError('A job must have a list of rules')
+    for i, rule in enumerate(job['rules']):
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError('Rule %i: unknown keys %s'
+                             % (i, ', '.join(sorted(unknown))))
+        unknown = set(rule.get('match', {})) - MATCH_KEYS
+        if unknown:
+            raise ValueError('Rule %i: unknown match keys %s'
+                             % (i, ', '.join(sorted(unknown))))
+        if rule.get('pivot_point', 'INDIVIDUAL_ORIGINS') not in PIVOT_POINTS:
+            raise ValueError('Rule %i: unknown pivot point %s'
+                             % (i, rule['pivot_point']))
+        if 'matrix' in rule and any(key in rule for key in
+                                    ('offset', 'rotation', 'scale')):
+            raise ValueError('Rule %i: matrix can\'t be combined with '
+                             'offset, rotation or scale' % i)
+    return job
+
+
+def matches(match, background_image):
+    """Whether a background image matches a rule's match patterns"""
+    image = background_image.image
+    if image is None:
+        return False
+    return (fnmatch.fnmatchcase(image.name, match.get('image', '*'))
+            and fnmatch.fnmatchcase(image.filepath,
+                                    match.get('filepath', '*'))
+            and match.get('view_axis',
+                          background_image.view_axis)
+            == background_image.view_axis)
+
+
+def apply_job(job, views, dry_run=False):
+    """Apply the rules of a job to views, given as (name, background
+    images) pairs. Return the changes, as dicts with the view, rule and
+    image, and the values (offset, rotation, size and flips) before and
+    after. With dry_run, the images are restored afterwards"""
+    import image_background_transform as ibt
+
+    changes = []
+    batches = []
+    for view_name, background_images in views:
+        for rule_index, rule in enumerate(job['rules']):
+            matched = [background_image
+                       for background_image in background_images
+                       if matches(rule.get('match', {}), background_image)]
+            # Offsets of camera images are in camera frame sizes
+            for camera in (False, True):
+                group = [background_image for background_image in matched
+                         if (background_image.view_axis == 'CAMERA')
+                         == camera]
+                if not group:
+                    continue
+                values, flips = ibt.get_layout_values(group)
+                batches.append(ibt.transform_background_images(
+                    group,
+                    offset=rule.get('offset', (0.0, 0.0)),
+                    angle=radians(rule.get('rotation', 0.0)),
+                    factor=rule.get('scale', 1.0),
+                    matrix=rule.get('matrix'),
+                    pivot_point=rule.get('pivot_point',
+                                         'INDIVIDUAL_ORIGINS'),
+                    cursor=rule.get('cursor', (0.0, 0.0)),
+                    camera=camera))
+                new_values, new_flips = ibt.get_layout_values(group)
+                changed = ((values != new_values).any(axis=1)
+                           | (flips != new_flips))
+                for i in changed.nonzero()[0].tolist():
+                    changes.append({
+                        'view': view_name,
+                        'rule': rule_index,
+                        'image': group[i].image.name,
+                        'before': values[i].tolist() + [int(flips[i])],
+                        'after': new_values[i].tolist()
+                        + [int(new_flips[i])]})
+
+    if dry_run:
+        for batch in reversed(batches):
+            batch.restore()
+    return changes
+
+
+class BlenderFiles:
+    """Access to .blend files, from background Blender processes"""
+
+    def __init__(self, binary_path='blender'):
+        self.binary_path = binary_path
+
+    def worker_command(self, filepath, arguments):
+        return ([self.binary_path, '--background', '--factory-startup',
+                 filepath, '--python', os.path.abspath(__file__), '--',
+                 '--worker'] + arguments)
+
+    def open(self, filepath):
+        """Open a file, and get its 3D Views' background images"""
+        import bpy
+        if (os.path.abspath(bpy.data.filepath)
+                != os.path.abspath(filepath)):
+            bpy.ops.wm.open_mainfile(filepath=filepath)
+        views = []
+        for screen in bpy.data.screens:
+            for i, area in enumerate(screen.areas):
+                if area.type == 'VIEW_3D':
+                    views.append(('%s/%i' % (screen.name, i),
+                                  area.spaces.active.background_images))
+        return views
+
+    def save(self, filepath):
+        import bpy
+        bpy.ops.wm.save_mainfile(filepath=filepath)
+
+
+def get_backend(name, blender='blender'):
+    """Get a file access backend, installing stand-ins of the Blender
+    modules for the stand-in backend"""
+    if name == 'stand-in':
+        sys.path.insert(0, os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        import stand_ins
+        stand_ins.install()
+        return stand_ins.StandInFiles(os.path.abspath(__file__))
+    return BlenderFiles(blender)
+
+
+def run_worker(backend, job_path, filepath, dry_run=False):
+    """Apply a job to a file, and print the result for the controller"""
+    start = time.perf_counter()
+    try:
+        job = load_job(job_path)
+        changes = apply_job(job, backend.open(filepath), dry_run)
+        if changes and not dry_run:
+            backend.save(filepath)
+        result = {'status': 'ok', 'changes': changes}
+    except Exception as error:
+        # Any failure is reported as the file's result
+        result = {'status': 'error',
+                  'error': '%s: %s' % (type(error).__name__, error)}
+    result['file'] = filepath
+    result['seconds'] = time.perf_counter() - start
+    print(RESULT_PREFIX + json.dumps(result))
+    sys.stdout.flush()
+
+
+def process_file(backend, job_path, filepath, dry_run=False):
+    """Run a worker process on a file, and get its result"""
+    arguments = [job_path, filepath]
+    if dry_run:
+        arguments.append('--dry-run')
+    start = time.perf_counter()
+    completed = subprocess.run(
+        backend.worker_command(filepath, arguments),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    result = None
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            result = json.loads(line[len(RESULT_PREFIX):])
+    if result is None:
+        errors = completed.stderr.strip().splitlines()
+        result = {'file': filepath, 'status': 'error',
+                  'error': 'Worker exited with status %i%s' % (
+                      completed.returncode,
+                      ': ' + errors[-1] if errors else '')}
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+
+def format_values(values):
+    return ('offset (%.4f, %.4f), rotation %.4f, size %.4f, flips %i'
+            % tuple(values))
+
+
+def print_result(result, dry_run=False):
+    if result['status'] != 'ok':
+        print('%s: %s' % (result['file'], result['error']))
+        return
+    print('%s: %i images %s (%.2fs)' % (
+        result['file'], len(result['changes']),
+        'to change' if dry_run else 'changed', result['wall_seconds']))
+    if dry_run:
+        for change in result['changes']:
+            print('    %s %s (rule %i): %s -> %s' % (
+                change['view'], change['image'], change['rule'],
+                format_values(change['before']),
+                format_values(change['after'])))
+
+
+def run(backend, job_path, filepaths, workers, dry_run=False):
+    """Process files in parallel worker processes, printing results as
+    they come. Return the results, in the order of the files"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, backend, job_path,
+                                   filepath, dry_run): filepath
+                   for filepath in filepaths}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            print_result(result, dry_run)
+    return [results[filepath] for filepath in filepaths]
+
+
+def main(argv=None):
+    if argv is None:
+        # Arguments after "--" when run by Blender
+        argv = (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv
+                else sys.argv[1:])
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('job', help='job file (JSON)')
+    parser.add_argument('files', nargs='+', help='.blend files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print changes without saving files')
+    parser.add_argument('--blender', default='blender',
+                        help='Blender executable running the workers')
+    parser.add_argument('--backend', default='blender',
+                        choices=('blender', 'stand-in'))
+    parser.add_argument('--results', help='write results to a JSON file')
+    parser.add_argument('--worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    backend = get_backend(args.backend, args.blender)
+    if args.worker:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        run_worker(backend, args.job, args.files[0], args.dry_run)
+        return 0
+
+    try:
+        load_job(args.job)
+    except (OSError, ValueError) as error:
+        print('Invalid job %s: %s' % (args.job, error))
+        return 2
+
+    start = time.perf_counter()
+    results = run(backend, os.path.abspath(args.job), args.files,
+                  args.workers, args.dry_run)
+    seconds = time.perf_counter() - start
+
+    failed = [result for result in results if result['status'] != 'ok']
+    image_count = sum(len(result.get('changes', ())) for result in results)
+    print('%i files, %i failed, %i images %s in %.2fs '
+          '(%.2f files/s, %.1f images/s)' % (
+              len(results), len(failed), image_count,
+              'to change' if args.dry_run else 'changed', seconds,
+              len(results) / seconds, image_count / seconds))
+
+    if args.results:
+        with open(args.results, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
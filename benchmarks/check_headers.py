@@ -0,0 +1,115 @@
+"""Check the image header readers on valid and truncated files, outside of
+Blender.
+
+Usage:
+    python benchmarks/check_headers.py
+
+A header is written for each format, then cut at every length: the full
+header must give its dimensions, and every truncated one None, without
+raising or hanging.
+
+The script exits with status 1 when a check fails.
+"""
+
+import os
+import struct
+import sys
+import tempfile
+
+import stand_ins
+
+stand_ins.install()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_background_transform as addon  # noqa: E402
+
+
+WIDTH, HEIGHT = 1920, 1080
+
+
+def png_header():
+    return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR'
+            + struct.pack('>II', WIDTH, HEIGHT) + b'\x08\x06\x00\x00\x00')
+
+
+def jpeg_header():
+    # Start of image, padded APP0 segment, then start of frame
+    app0 = b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    return (b'\xff\xd8' + b'\xff\xff\xe0' + struct.pack('>H', len(app0) + 2)
+            + app0 + b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, HEIGHT,
+                                                WIDTH, 3)
+            + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+
+
+def tiff_header():
+    entries = [(254, 4, 1, struct.pack('<I', 0)),
+               (256, 3, 1, struct.pack('<HH', WIDTH, 0)),
+               (257, 4, 1, struct.pack('<I', HEIGHT))]
+    return (b'II*\x00' + struct.pack('<I', 8)
+            + struct.pack('<H', len(entries))
+            + b''.join(struct.pack('<HHI4s', *entry) for entry in entries)
+            + struct.pack('<I', 0))
+
+
+def exr_header():
+    def attribute(name, value_type, value):
+        return (name + b'\x00' + value_type + b'\x00'
+                + struct.pack('<i', len(value)) + value)
+    return (b'\x76\x2f\x31\x01\x02\x00\x00\x00'
+            + attribute(b'channels', b'chlist', b'R\x00' + bytes(16) + b'\x00')
+            + attribute(b'compression', b'compression', b'\x00')
+            + attribute(b'dataWindow', b'box2i',
+                        struct.pack('<4i', 0, 0, WIDTH - 1, HEIGHT - 1))
+            + b'\x00')
+
+
+HEADERS = {'.png': png_header,
+           '.jpg': jpeg_header,
+           '.tif': tiff_header,
+           '.exr': exr_header}
+
+
+def read(directory, extension, data):
+    """Read the dimensions of a file holding data, as the add-on does"""
+    filepath = os.path.join(directory, 'image%s' % extension)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    addon.dimensions_cache.clear()
+    try:
+        return addon.read_image_dimensions(filepath)
+    except Exception as error:
+        return error
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for extension, get_header in sorted(HEADERS.items()):
+            header = get_header()
+            dimensions = read(directory, extension, header)
+            if dimensions != (WIDTH, HEIGHT):
+                failures.append('%s: read %r from the full header'
+                                % (extension, dimensions))
+            # The last bytes may not be needed for the dimensions
+            truncated = {}
+            for length in range(len(header)):
+                dimensions = read(directory, extension, header[:length])
+                if dimensions is not None and dimensions != (WIDTH, HEIGHT):
+                    truncated[length] = dimensions
+            for length, dimensions in sorted(truncated.items()):
+                failures.append('%s: read %r from %i bytes'
+                                % (extension, dimensions, length))
+            print('%-5s %3i truncations, %i failed'
+                  % (extension, len(header), len(truncated)))
+
+        # Padding up to the end of the file
+        dimensions = read(directory, '.jpg', b'\xff\xd8\xff\xff')
+        if dimensions is not None:
+            failures.append('.jpg: read %r from padding' % (dimensions,))
+
+    for failure in failures:
+        print('FAILED ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Replay event streams through the background image transform operator
+outside of Blender, and compare per-event latencies against a baseline.
+
+Usage:
+    python benchmarks/replay.py [--counts 1 10 100 1000]
+                                [--scenarios translate rotate ...]
+                                [--events recorded.json ...]
+                                [--pivot MEDIAN_POINT]
+                                [--update-rate 60] [--event-rate 1000]
+                                [--profile] [--preview]
+                                [--baseline benchmarks/baseline.json]
+                                [--save-baseline] [--tolerance 0.25]
+
+Redraws requested by the operator are drawn with a stand-in overlay
+backend, and timed separately.
+
+With --profile, the operator's own profiling is enabled, and the
+durations of its phases are printed after each scenario.
+
+With --preview, transformed images are drawn by the overlay, and their
+properties only set on confirm.
+
+With an update rate, timer events are interleaved with the stream as if
+events came in at the given event rate.
+
+Recorded streams are JSON lists of events, each one a dict with a "type"
+and optional "value", "x", "y", "ctrl" and "shift" keys, as in Blender's
+event structure.
+
+The script exits with status 1 when a scenario is slower, or allocates
+more, than its baseline by more than the tolerance, or when there is no
+baseline to compare against. Latencies depend on the machine, so
+baselines aren't committed: save one on the machine comparing revisions.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import types
+from math import cos, sin, pi
+
+import stand_ins
+
+stand_ins.install()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_background_transform as addon  # noqa: E402
+
+addon.BackgroundImageTransform.overlay_backend = stand_ins.OverlayBackend
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+CENTER = (960, 540)
+
+
+def make_board(count, seed=0):
+    """Create background images laid out on a grid, with varied ratios"""
+    rng = random.Random(seed)
+    columns = max(1, int(count ** 0.5))
+    images = []
+    for i in range(count):
+        image = stand_ins.Image('plate_%04i' % i,
+                                rng.choice((1024, 2048, 4096)),
+                                rng.choice((768, 1536, 3072)))
+        images.append(stand_ins.BackgroundImage(
+            image,
+            offset=(i % columns * 6.0, i // columns * 6.0),
+            rotation=rng.uniform(-pi, pi),
+            size=rng.uniform(2.0, 8.0)))
+    return images
+
+
+def _moves(count, path, **modifiers):
+    return [stand_ins.Event('MOUSEMOVE', 'NOTHING', *path(i / count),
+                            **modifiers)
+            for i in range(count)]
+
+
+def _line(t):
+    return (int(CENTER[0] + 100 + 400 * t), int(CENTER[1] + 50 + 200 * t))
+
+
+def _circle(t):
+    return (int(CENTER[0] + 200 * cos(2 * pi * t)),
+            int(CENTER[1] + 200 * sin(2 * pi * t)))
+
+
+def _key(type, x=CENTER[0] + 100, y=CENTER[1] + 50):
+    return stand_ins.Event(type, 'PRESS', x, y)
+
+
+def scenario_translate():
+    return [_key('A'), _key('G')] + _moves(500, _line)
+
+
+def scenario_rotate():
+    return [_key('A'), _key('R')] + _moves(500, _circle)
+
+
+def scenario_scale():
+    return ([_key('A'), _key('S')] + _moves(250, _line)
+            + _moves(250, _line, ctrl=True))
+
+
+def scenario_switch():
+    events = [_key('A')]
+    for mode in 'GRSGRS':
+        events.append(_key(mode))
+        events += _moves(50, _circle)
+    return events
+
+
+def scenario_wheel():
+    events = [_key('G')]
+    for i in range(100):
+        events.append(_key('WHEELUPMOUSE' if i % 4 else 'WHEELDOWNMOUSE'))
+        events += _moves(5, _line)
+    return events
+
+
+def scenario_numeric():
+    events = [_key('A'), _key('S')]
+    for digit in ('ONE', 'PERIOD', 'FIVE', 'BACK_SPACE', 'TWO',
+                  'MINUS', 'SLASH', 'MINUS'):
+        events.append(_key(digit))
+        events += _moves(20, _line)
+    return events
+
+
+SCENARIOS = {name[len('scenario_'):]: function
+             for name, function in globals().items()
+             if name.startswith('scenario_')}
+
+
+def load_events(filepath):
+    with open(filepath) as f:
+        return [stand_ins.Event(e['type'], e.get('value', 'PRESS'),
+                                e.get('x', 0), e.get('y', 0),
+                                e.get('ctrl', False), e.get('shift', False))
+                for e in json.load(f)]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def add_timer_events(events, update_rate, event_rate):
+    """Interleave timer events with a stream"""
+    if update_rate <= 0.0:
+        return events
+    step = max(1, int(round(event_rate / update_rate)))
+    timed_events = []
+    for i, event in enumerate(events, 1):
+        timed_events.append(event)
+        if i % step == 0:
+            timed_events.append(stand_ins.Event(
+                'TIMER', 'NOTHING',
+                event.mouse_region_x, event.mouse_region_y))
+    return timed_events
+
+
+def start_operator(count, pivot_point, update_rate, profile=False,
+                   preview=False):
+    addon.persistent_settings.update(active_image=0, transform_all=False,
+                                     sync_views=False)
+    context = stand_ins.Context(make_board(count), pivot_point)
+    preferences = addon.BackgroundImageTransformPreferences()
+    preferences.update_rate = update_rate
+    preferences.profile = profile
+    preferences.preview = preview
+    context.user_preferences.addons[addon.__name__] = (
+        types.SimpleNamespace(preferences=preferences))
+    operator = addon.BackgroundImageTransform()
+    operator.invoke(context, stand_ins.Event('B', 'PRESS', *CENTER))
+    stand_ins.reset_counters()
+    return operator, context
+
+
+def draw(operator):
+    """Call the operator's draw handler, as Blender does on redraws"""
+    callback, args = operator._handle
+    callback(*args)
+
+
+def replay(events, count, pivot_point, update_rate=0.0, profile=False,
+           preview=False):
+    """Run events through a fresh operator, and measure each modal call,
+    and each redraw it requests"""
+    addon.profiler.clear()
+    operator, context = start_operator(count, pivot_point, update_rate,
+                                       profile, preview)
+    latencies = []
+    draw_latencies = []
+    for event in events:
+        redraws = stand_ins.counters['redraws']
+        start = time.perf_counter()
+        result = operator.modal(context, event)
+        latencies.append(time.perf_counter() - start)
+        if (stand_ins.counters['redraws'] != redraws
+                and result == {'RUNNING_MODAL'}):
+            start = time.perf_counter()
+            draw(operator)
+            draw_latencies.append(time.perf_counter() - start)
+    counts = dict(stand_ins.counters)
+    summary = addon.profiler.get_summary()
+
+    # Allocations are measured in a separate pass,
+    # since tracing them slows the operator down
+    operator, context = start_operator(count, pivot_point, update_rate,
+                                       preview=preview)
+    allocations = []
+    tracemalloc.start()
+    for event in events:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        operator.modal(context, event)
+        allocations.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    latencies.sort()
+    draw_latencies.sort()
+    return {
+        'events': len(events),
+        'p50_ms': percentile(latencies, 0.5) * 1000.0,
+        'p95_ms': percentile(latencies, 0.95) * 1000.0,
+        'p99_ms': percentile(latencies, 0.99) * 1000.0,
+        'draw_p95_ms': (percentile(draw_latencies, 0.95) * 1000.0
+                        if draw_latencies else 0.0),
+        'alloc_mean_bytes': sum(allocations) / len(allocations),
+        'rna_writes_per_event': counts['rna_writes'] / len(events),
+        'redraws_per_event': counts['redraws'] / len(events),
+        'header_updates_per_event': counts['header_updates'] / len(events),
+        'batches_built_per_event': counts['batches_built'] / len(events),
+        'textures_built': counts['textures_built'],
+        'profile': summary,
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """Get a list of regressions of a result compared to its baseline"""
+    regressions = []
+    for key in ('p95_ms', 'draw_p95_ms', 'alloc_mean_bytes',
+                'rna_writes_per_event'):
+        if key in baseline and result[key] > baseline[key] * (1.0 + tolerance):
+            regressions.append('%s: %s %.4g > %.4g' % (
+                name, key, result[key], baseline[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--counts', type=int, nargs='+',
+                        default=[1, 10, 100, 1000])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--events', nargs='*', default=[],
+                        help='recorded event streams (JSON)')
+    parser.add_argument('--pivot', default='MEDIAN_POINT',
+                        choices=('CURSOR', 'BOUNDING_BOX_CENTER',
+                                 'MEDIAN_POINT', 'ACTIVE_ELEMENT',
+                                 'INDIVIDUAL_ORIGINS'))
+    parser.add_argument('--update-rate', type=float, default=0.0,
+                        help='updates per second, 0 to update on every event')
+    parser.add_argument('--event-rate', type=float, default=1000.0,
+                        help='simulated input events per second')
+    parser.add_argument('--profile', action='store_true',
+                        help="print the operator's own phase durations")
+    parser.add_argument('--preview', action='store_true',
+                        help='draw transformed images in the overlay')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    streams = {name: SCENARIOS[name]() for name in args.scenarios}
+    for filepath in args.events:
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        streams[name] = load_events(filepath)
+    streams = {name: add_timer_events(events, args.update_rate,
+                                      args.event_rate)
+               for name, events in streams.items()}
+
+    results = {}
+    print('%-24s %7s %9s %9s %9s %9s %11s %8s' % (
+        'scenario', 'events', 'p50 ms', 'p95 ms', 'p99 ms', 'draw ms',
+        'alloc B', 'writes'))
+    for name, events in streams.items():
+        for count in args.counts:
+            key = '%s-%i' % (name, count)
+            result = results[key] = replay(events, count, args.pivot,
+                                          args.update_rate, args.profile,
+                                          args.preview)
+            print('%-24s %7i %9.4f %9.4f %9.4f %9.4f %11.0f %8.1f' % (
+                key, result['events'], result['p50_ms'], result['p95_ms'],
+                result['p99_ms'], result['draw_p95_ms'],
+                result['alloc_mean_bytes'],
+                result['rna_writes_per_event']))
+            for phase, stats in sorted(result['profile'].items()):
+                print('    %-20s %7i calls %9.4f ms mean %9.4f ms max' % (
+                    phase, stats['calls'], stats['mean_ms'],
+                    stats['max_ms']))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found at %s, save one with --save-baseline'
+              % args.baseline)
+        return 1
+
+    with open(args.baseline) as f:
+        baselines = json.load(f)
+    regressions = []
+    for key, result in results.items():
+        if key in baselines:
+            regressions += compare(key, result, baselines[key],
+                                   args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
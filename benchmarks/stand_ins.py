@@ -0,0 +1,588 @@
+"""Minimal stand-ins for the Blender modules used by the add-on.
+
+They implement just enough of bpy, bgl, bpy_extras.view3d_utils and
+mathutils to run the operator outside of Blender, in a top ortho view.
+Property writes, redraws and header updates are counted so that the
+cost of the operator can be compared between revisions.
+"""
+
+import copy
+import json
+import os
+import sys
+import types
+from math import atan2, sqrt
+
+
+counters = {'rna_writes': 0,
+            'redraws': 0,
+            'header_updates': 0,
+            'batches_built': 0,
+            'batches_drawn': 0,
+            'textures_built': 0,
+            'textures_drawn': 0}
+
+
+def reset_counters():
+    for key in counters:
+        counters[key] = 0
+
+
+# mathutils
+
+class Vector:
+    """Subset of mathutils.Vector, with 2.79 semantics
+    (Vector * Vector is a dot product)"""
+    __slots__ = ('_data',)
+    _axes = 'xyzw'
+
+    def __init__(self, seq=(0.0, 0.0, 0.0)):
+        object.__setattr__(self, '_data', [float(v) for v in seq])
+
+    def _get_axis(i):
+        def getter(self):
+            return self._data[i]
+
+        def setter(self, value):
+            self._data[i] = float(value)
+        return property(getter, setter)
+
+    x = _get_axis(0)
+    y = _get_axis(1)
+    z = _get_axis(2)
+    w = _get_axis(3)
+    del _get_axis
+
+    def __getattr__(self, name):
+        if 2 <= len(name) <= 4 and all(c in self._axes for c in name):
+            return Vector(self._data[self._axes.index(c)] for c in name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if (len(name) >= 2
+                and all(c in self._axes for c in name)):
+            for c, v in zip(name, value):
+                self._data[self._axes.index(c)] = float(v)
+        else:
+            object.__setattr__(self, name, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        self._data[index] = float(value)
+
+    def __repr__(self):
+        return 'Vector(%r)' % (tuple(self._data),)
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self._data, other))
+
+    def __radd__(self, other):
+        return self + other
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self._data, other))
+
+    def __rsub__(self, other):
+        return Vector(b - a for a, b in zip(self._data, other))
+
+    def __mul__(self, other):
+        if isinstance(other, Vector):
+            return self.dot(other)
+        return Vector(a * other for a in self._data)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return Vector(a / other for a in self._data)
+
+    def __neg__(self):
+        return Vector(-a for a in self._data)
+
+    def copy(self):
+        return Vector(self._data)
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self._data, other))
+
+    @property
+    def length_squared(self):
+        return self.dot(self)
+
+    @property
+    def length(self):
+        return sqrt(self.length_squared)
+
+    def angle_signed(self, other):
+        if not self.length_squared or not Vector(other).length_squared:
+            raise ValueError('angle_signed() zero length vector')
+        perp_dot = self.y * other[0] - self.x * other[1]
+        return atan2(perp_dot, self.dot(other))
+
+
+class KDTree:
+    """Brute force stand-in for mathutils.kdtree.KDTree"""
+
+    def __init__(self, size):
+        self.points = []
+
+    def insert(self, co, index):
+        self.points.append((Vector(co), index))
+
+    def balance(self):
+        pass
+
+    def find(self, co):
+        co = Vector(co)
+        closest = (None, None, None)
+        for point, index in self.points:
+            distance = (point - co).length
+            if closest[2] is None or distance < closest[2]:
+                closest = (point.copy(), index, distance)
+        return closest
+
+
+class Euler(tuple):
+    pass
+
+
+class Quaternion:
+    """Only stores the Euler rotation it converts to"""
+
+    def __init__(self, euler=(0.0, 0.0, 0.0)):
+        self.euler = Euler(euler)
+
+    def to_euler(self):
+        return self.euler
+
+
+# bpy_extras.view3d_utils, for a top ortho view
+
+def region_2d_to_location_3d(region, rv3d, coord, depth_location):
+    return Vector((
+        (coord[0] - region.width / 2) / rv3d.pixels_per_unit
+        + rv3d.view_location[0],
+        (coord[1] - region.height / 2) / rv3d.pixels_per_unit
+        + rv3d.view_location[1],
+        depth_location[2]))
+
+
+def location_3d_to_region_2d(region, rv3d, coord, default=None):
+    return Vector((
+        (coord[0] - rv3d.view_location[0]) * rv3d.pixels_per_unit
+        + region.width / 2,
+        (coord[1] - rv3d.view_location[1]) * rv3d.pixels_per_unit
+        + region.height / 2))
+
+
+# bpy data
+
+class Image:
+    def __init__(self, name, width, height, filepath='', pixels=None):
+        self.name = name
+        self.size = (width, height)
+        self.filepath = filepath
+        self.channels = 4
+        self._pixels = pixels
+        self.is_dirty = False
+        self.packed_file = None
+        self.source = 'FILE'
+        self.library = None
+        self.has_data = False
+
+    @property
+    def pixels(self):
+        # Only allocated when read, as Blender loads pixels on access
+        if self._pixels is None:
+            self._pixels = [0.0] * (self.size[0] * self.size[1] * 4)
+        return self._pixels
+
+    @pixels.setter
+    def pixels(self, pixels):
+        self._pixels = pixels
+
+    def copy(self):
+        image = Image(self.name + '.001', self.size[0], self.size[1],
+                      self.filepath, list(self.pixels))
+        image.channels = self.channels
+        return image
+
+    def scale(self, width, height):
+        """Resize pixels, with nearest neighbour sampling"""
+        old_width, old_height = self.size
+        channels = self.channels
+        pixels = self.pixels
+        scaled = []
+        for y in range(height):
+            row = y * old_height // height * old_width
+            for x in range(width):
+                start = (row + x * old_width // width) * channels
+                scaled.extend(pixels[start:start + channels])
+        self.size = (width, height)
+        self._pixels = scaled
+
+
+class BackgroundImage:
+    """Background image settings, counting property writes like RNA"""
+    _counted = {'offset_x', 'offset_y', 'rotation', 'size',
+                'use_flip_x', 'use_flip_y'}
+
+    def __init__(self, image, offset=(0.0, 0.0), rotation=0.0, size=5.0,
+                 view_axis='ALL'):
+        self.image = image
+        self.offset_x, self.offset_y = offset
+        self.rotation = rotation
+        self.size = size
+        self.use_flip_x = False
+        self.use_flip_y = False
+        self.view_axis = view_axis
+        self.show_background_image = True
+        self.opacity = 0.5
+
+    def as_pointer(self):
+        return id(self)
+
+    def __setattr__(self, name, value):
+        if name in self._counted:
+            counters['rna_writes'] += 1
+        object.__setattr__(self, name, value)
+
+
+class BackgroundImages(list):
+    """Background image collection, with bulk reads as bpy collections"""
+
+    def foreach_get(self, attribute, sequence):
+        sequence[:] = [getattr(background_image, attribute)
+                       for background_image in self]
+
+
+class IDPropertyGroup(dict):
+    """ID property group, nested dicts being groups too"""
+
+    def __init__(self, value=()):
+        super().__init__({key: IDPropertyGroup(item)
+                          if isinstance(item, dict) else item
+                          for key, item in dict(value).items()})
+
+    def to_dict(self):
+        return {key: item.to_dict() if isinstance(item, IDPropertyGroup)
+                else copy.deepcopy(item) for key, item in self.items()}
+
+
+class Scene(dict):
+    """Scene, with ID properties stored as groups"""
+
+    def __init__(self):
+        super().__init__()
+        self.frame_current = 1
+        self.render = types.SimpleNamespace(fps=24, fps_base=1.0)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, dict):
+            value = IDPropertyGroup(copy.deepcopy(value))
+        super().__setitem__(key, value)
+
+
+class Area:
+    type = 'VIEW_3D'
+
+    def __init__(self, space):
+        self.spaces = types.SimpleNamespace(active=space)
+
+    def tag_redraw(self):
+        counters['redraws'] += 1
+
+    def header_text_set(self, text=None):
+        counters['header_updates'] += 1
+
+
+class Region:
+    def __init__(self, width=1920, height=1080):
+        self.width = width
+        self.height = height
+
+
+class RegionView3D:
+    def __init__(self, region, pixels_per_unit=50.0):
+        self.region = region
+        self.view_perspective = 'ORTHO'
+        self.view_rotation = Quaternion()
+        self.view_location = Vector()
+        self.pixels_per_unit = pixels_per_unit
+
+    @property
+    def perspective_matrix(self):
+        """World to clip space matrix of a top ortho view"""
+        scale_x = self.pixels_per_unit * 2.0 / self.region.width
+        scale_y = self.pixels_per_unit * 2.0 / self.region.height
+        return ((scale_x, 0.0, 0.0, -self.view_location[0] * scale_x),
+                (0.0, scale_y, 0.0, -self.view_location[1] * scale_y),
+                (0.0, 0.0, -0.001, 0.0),
+                (0.0, 0.0, 0.0, 1.0))
+
+
+class SpaceView3D:
+    type = 'VIEW_3D'
+
+    def __init__(self, background_images, pivot_point='MEDIAN_POINT'):
+        self.background_images = BackgroundImages(background_images)
+        self.pivot_point = pivot_point
+        self.cursor_location = Vector()
+
+    def as_pointer(self):
+        return id(self)
+
+    @staticmethod
+    def draw_handler_add(callback, args, region_type, draw_type):
+        return (callback, args)
+
+    @staticmethod
+    def draw_handler_remove(handle, region_type):
+        pass
+
+
+class WindowManager:
+    def __init__(self, areas):
+        self.handlers = []
+        self.windows = [types.SimpleNamespace(
+            screen=types.SimpleNamespace(areas=areas))]
+
+    def modal_handler_add(self, operator):
+        self.handlers.append(operator)
+
+    def event_timer_add(self, time_step, window=None):
+        return types.SimpleNamespace(time_step=time_step)
+
+    def event_timer_remove(self, timer):
+        pass
+
+
+class UserPreferences:
+    def __init__(self):
+        self.addons = {}
+
+
+class Context:
+    def __init__(self, background_images, pivot_point='MEDIAN_POINT'):
+        self.user_preferences = UserPreferences()
+        self.space_data = SpaceView3D(background_images, pivot_point)
+        self.area = Area(self.space_data)
+        self.region = Region()
+        self.region_data = RegionView3D(self.region)
+        self.window_manager = WindowManager([self.area])
+        self.window = None
+        self.scene = Scene()
+
+    def add_view(self, background_images):
+        """Add another 3D View area to the screen"""
+        area = Area(SpaceView3D(background_images))
+        self.window_manager.windows[0].screen.areas.append(area)
+        return area
+
+
+class Event:
+    __slots__ = ('type', 'value', 'mouse_region_x', 'mouse_region_y',
+                 'ctrl', 'shift', 'alt')
+
+    def __init__(self, type, value='PRESS', x=0, y=0,
+                 ctrl=False, shift=False, alt=False):
+        self.type = type
+        self.value = value
+        self.mouse_region_x = x
+        self.mouse_region_y = y
+        self.ctrl = ctrl
+        self.shift = shift
+        self.alt = alt
+
+
+# Overlay drawing
+
+class OverlayBackend:
+    """Overlay drawing backend keeping batches instead of drawing them"""
+
+    def __init__(self):
+        self.batches = {}
+        self.textures = {}
+        self.next_handle = 1
+
+    def create_batch(self, primitive, vertices):
+        counters['batches_built'] += 1
+        handle = self.next_handle
+        self.next_handle += 1
+        self.batches[handle] = (primitive, vertices)
+        return handle
+
+    def delete_batch(self, handle):
+        del self.batches[handle]
+
+    def draw_batch(self, handle, color, matrix=None, width=1.0,
+                   stipple=False):
+        assert handle in self.batches
+        counters['batches_drawn'] += 1
+
+    def create_texture(self, image):
+        counters['textures_built'] += 1
+        handle = self.next_handle
+        self.next_handle += 1
+        self.textures[handle] = image
+        return handle
+
+    def delete_texture(self, handle):
+        del self.textures[handle]
+
+    def draw_texture(self, handle, vertices, uvs, opacity=1.0, matrix=None):
+        assert handle in self.textures
+        assert vertices.shape == uvs.shape == (4, 2)
+        counters['textures_drawn'] += 1
+
+
+# Batch processing
+
+class StandInFiles:
+    """Batch processing file access on JSON documents, in place of .blend
+    files, with workers run by this Python instead of Blender.
+
+    Documents list views, each one with a name and background images:
+    {"views": [{"name": "Default/1", "background_images": [
+        {"image": "plate", "width": 2048, "height": 1024,
+         "filepath": "//plate.png", "view_axis": "TOP",
+         "offset": [0, 0], "rotation": 0, "size": 5,
+         "use_flip_x": false, "use_flip_y": false}]}]}
+    """
+
+    def __init__(self, script_path):
+        self.script_path = script_path
+        self.document = None
+
+    def worker_command(self, filepath, arguments):
+        return ([sys.executable, self.script_path, '--worker',
+                 '--backend', 'stand-in'] + arguments)
+
+    def open(self, filepath):
+        with open(filepath) as f:
+            self.document = json.load(f)
+        views = []
+        for view in self.document['views']:
+            background_images = []
+            for settings in view['background_images']:
+                image = Image(settings['image'], settings['width'],
+                              settings['height'],
+                              settings.get('filepath', ''))
+                background_image = BackgroundImage(
+                    image, settings.get('offset', (0.0, 0.0)),
+                    settings.get('rotation', 0.0), settings.get('size', 5.0),
+                    settings.get('view_axis', 'ALL'))
+                background_image.use_flip_x = settings.get('use_flip_x',
+                                                           False)
+                background_image.use_flip_y = settings.get('use_flip_y',
+                                                           False)
+                background_images.append(background_image)
+            view['_background_images'] = background_images
+            views.append((view['name'], background_images))
+        return views
+
+    def save(self, filepath):
+        for view in self.document['views']:
+            for settings, background_image in zip(
+                    view['background_images'],
+                    view.pop('_background_images')):
+                settings.update(
+                    offset=[background_image.offset_x,
+                            background_image.offset_y],
+                    rotation=background_image.rotation,
+                    size=background_image.size,
+                    use_flip_x=background_image.use_flip_x,
+                    use_flip_y=background_image.use_flip_y)
+        with open(filepath, 'w') as f:
+            json.dump(self.document, f, indent=1)
+
+
+# bpy.types, bpy.props
+
+class Operator:
+    def report(self, type, message):
+        pass
+
+
+def abspath(path, start=None, library=None):
+    if path.startswith('//'):
+        path = os.path.join(start or os.getcwd(), path[2:])
+    return os.path.abspath(path)
+
+
+class ExportHelper:
+    filepath = ''
+
+
+def _property(**kwargs):
+    return kwargs.get('default')
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    """Register the stand-ins in sys.modules, in place of Blender's"""
+    bpy_types = _module(
+        'bpy.types', Operator=Operator, SpaceView3D=SpaceView3D,
+        Panel=object, PropertyGroup=object, AddonPreferences=object,
+        VIEW3D_PT_background_image=types.SimpleNamespace(
+            append=lambda f: None, remove=lambda f: None))
+    bpy_props = _module('bpy.props', **{
+        name: _property for name in (
+            'BoolProperty', 'IntProperty', 'FloatProperty',
+            'FloatVectorProperty', 'EnumProperty', 'StringProperty',
+            'CollectionProperty', 'PointerProperty')})
+    bpy_utils = _module('bpy.utils', register_class=lambda cls: None,
+                        unregister_class=lambda cls: None)
+    bpy_app_handlers = _module('bpy.app.handlers', persistent=lambda f: f,
+                               frame_change_post=[])
+    bpy_app = _module('bpy.app', version=(2, 79, 0), binary_path='blender',
+                      handlers=bpy_app_handlers)
+    bpy_path = _module('bpy.path', abspath=abspath)
+    bpy = _module('bpy', types=bpy_types, props=bpy_props, utils=bpy_utils,
+                  app=bpy_app, path=bpy_path, context=None, data=None)
+
+    view3d_utils = _module(
+        'bpy_extras.view3d_utils',
+        region_2d_to_location_3d=region_2d_to_location_3d,
+        location_3d_to_region_2d=location_3d_to_region_2d)
+    io_utils = _module('bpy_extras.io_utils', ExportHelper=ExportHelper)
+    bpy_extras = _module('bpy_extras', view3d_utils=view3d_utils,
+                         io_utils=io_utils)
+
+    bgl = _module('bgl')
+    bgl.__getattr__ = lambda name: (lambda *args: None)
+    for name in ('GL_BLEND', 'GL_LINE_STIPPLE', 'GL_LINE_STRIP', 'GL_LINES',
+                 'GL_LINE_LOOP', 'GL_QUADS', 'GL_TEXTURE_2D'):
+        setattr(bgl, name, 0)
+
+    kdtree = _module('mathutils.kdtree', KDTree=KDTree)
+    mathutils = _module('mathutils', Vector=Vector, Quaternion=Quaternion,
+                        Euler=Euler, kdtree=kdtree)
+
+    sys.modules.update({
+        'bpy': bpy,
+        'bpy.types': bpy_types,
+        'bpy.props': bpy_props,
+        'bpy.utils': bpy_utils,
+        'bpy.app': bpy_app,
+        'bpy.app.handlers': bpy_app_handlers,
+        'bpy.path': bpy_path,
+        'bpy_extras': bpy_extras,
+        'bpy_extras.view3d_utils': view3d_utils,
+        'bpy_extras.io_utils': io_utils,
+        'bgl': bgl,
+        'mathutils': mathutils,
+        'mathutils.kdtree': kdtree,
+    })
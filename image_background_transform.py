@@ -27,33 +27,197 @@ bl_info = {
     }
 
 import bpy
-from bpy_extras import view3d_utils
-from bpy.props import FloatVectorProperty
+from bpy.props import (BoolProperty, EnumProperty, FloatProperty,
+                       FloatVectorProperty, IntProperty, StringProperty)
+from bpy.app.handlers import persistent
+from bpy_extras.io_utils import ExportHelper
 import bgl
-from math import radians, degrees, pi, cos, sin, copysign
-from mathutils import Vector
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import struct
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from math import radians, degrees, pi
+from time import perf_counter
+from mathutils import Vector, kdtree
 
 # TODO
 # perspective
 
 persistent_settings = {'active_image': 0,
-                       'transform_all': False}
+                       'transform_all': False,
+                       'sync_views': False}
+
+
+def _round_angle(x):
+    return round(x, 3)
+
+
+VIEW_ORIENTATIONS = {
+    (0.0, 0.0, 0.0):                                    'TOP',
+    (_round_angle(pi), 0.0, 0.0):                       'BOTTOM',
+    (_round_angle(pi/2), 0.0, 0.0):                     'FRONT',
+    (_round_angle(pi/2), 0.0, _round_angle(pi)):        'BACK',
+    (_round_angle(pi/2), 0.0, _round_angle(-pi/2)):     'LEFT',
+    (_round_angle(pi/2), 0.0, _round_angle(pi/2)):      'RIGHT',
+}
 
 
 def get_view_orientation_from_quaternion(view_quat):
     """From https://blender.stackexchange.com/a/3428/4979"""
-    def r(x):
-        return round(x, 3)
     view_rot = view_quat.to_euler()
-
-    orientation_dict = {(0.0, 0.0, 0.0):          'TOP',
-                        (r(pi), 0.0, 0.0):        'BOTTOM',
-                        (r(pi/2), 0.0, 0.0):      'FRONT',
-                        (r(pi/2), 0.0, r(pi)):    'BACK',
-                        (r(pi/2), 0.0, r(-pi/2)): 'LEFT',
-                        (r(pi/2), 0.0, r(pi/2)):  'RIGHT'}
-
-    return orientation_dict.get(tuple(map(r, view_rot)), 'UNDEFINED')
+    return VIEW_ORIENTATIONS.get(tuple(map(_round_angle, view_rot)),
+                                 'UNDEFINED')
+
+
+def is_visible(background_image, rv3d, orientation):
+    """Whether a background image is shown in a 3D View, given the view's
+    orientation"""
+    image_orientation = background_image.view_axis
+    return (background_image.show_background_image
+            and background_image.image is not None
+            and (rv3d.view_perspective == 'CAMERA'
+                 and image_orientation in {'CAMERA', 'ALL'}
+                 or rv3d.view_perspective == 'ORTHO'
+                 and orientation != 'UNDEFINED'
+                 and image_orientation in {orientation, 'ALL'}
+                 ))
+
+
+def get_visible_images(space, rv3d, orientation):
+    """Get the background images of a 3D View shown in its current view,
+    given the view's orientation"""
+    return [background_image for background_image in space.background_images
+            if is_visible(background_image, rv3d, orientation)]
+
+
+# Visible background images of 3D Views, by space pointer, with their
+# indices and image dimensions, kept between invocations. Blender 2.79
+# has no notifications for space data: entries are checked against the
+# view and the images' visibility flags, read in one call, and dropped on
+# file loads, undo, image updates and edits in the Background Images panel
+visible_image_cache = {}
+
+
+def get_visibility_state(space, rv3d, orientation):
+    """Get what decides which background images of a 3D View are shown,
+    without reading the images one by one. The first and last images tell
+    apart collections of views reusing a freed view's pointer"""
+    background_images = space.background_images
+    shown = [False] * len(background_images)
+    background_images.foreach_get('show_background_image', shown)
+    ends = ((background_images[0].as_pointer(),
+             background_images[-1].as_pointer())
+            if len(background_images) else ())
+    return rv3d.view_perspective, orientation, ends, tuple(shown)
+
+
+def get_images_state(background_images):
+    return tuple((background_image.image, background_image.view_axis)
+                 for background_image in background_images)
+
+
+def get_cached_visible_images(space, rv3d, orientation):
+    """Get the visible background images of a 3D View, as a dict with the
+    images, their indices in the view's background images and their image
+    dimensions, rescanning the view only if it changed"""
+    key = space.as_pointer()
+    state = get_visibility_state(space, rv3d, orientation)
+    entry = visible_image_cache.get(key)
+    if entry is None or entry['state'] != state:
+        background_images = space.background_images
+        indices = [i for i, background_image in enumerate(background_images)
+                   if is_visible(background_image, rv3d, orientation)]
+        images = [background_images[i] for i in indices]
+        entry = visible_image_cache[key] = {
+            'state': state,
+            'images_state': get_images_state(background_images),
+            'indices': np.array(indices, dtype=int),
+            'images': images,
+            'dimensions': get_image_dimensions(
+                [background_image.image for background_image in images]),
+            'in_use': False}
+    return entry
+
+
+def check_visible_images(space):
+    """Forget the visible images of a 3D View if their images or axes
+    changed, unless they're being transformed"""
+    entry = visible_image_cache.get(space.as_pointer())
+    if (entry is not None and not entry['in_use']
+            and entry['images_state']
+            != get_images_state(space.background_images)):
+        del visible_image_cache[space.as_pointer()]
+
+
+def invalidate_visible_images(space=None):
+    """Forget the visible images of a 3D View, or of all 3D Views. To be
+    called by scripts adding, removing or changing background images"""
+    if space is None:
+        visible_image_cache.clear()
+    else:
+        visible_image_cache.pop(space.as_pointer(), None)
+
+
+@persistent
+def clear_visible_images(*args):
+    visible_image_cache.clear()
+
+
+@persistent
+def check_updated_images(scene):
+    if bpy.data.images.is_updated:
+        visible_image_cache.clear()
+
+
+def read_background_image_values(background_images, indices):
+    """Get the offsets, rotations, sizes and flips of background images of
+    a collection, by index, reading each property of all images at once"""
+    values = {}
+    for name in ('offset_x', 'offset_y', 'rotation', 'size',
+                 'use_flip_x', 'use_flip_y'):
+        sequence = [0.0] * len(background_images)
+        background_images.foreach_get(name, sequence)
+        values[name] = np.array(sequence, dtype=float)[indices]
+    return (np.column_stack((values['offset_x'], values['offset_y'])),
+            values['rotation'], values['size'],
+            np.column_stack((values['use_flip_x'], values['use_flip_y']))
+            .astype(bool))
+
+
+def get_background_image_key(background_image):
+    return (background_image.image, background_image.view_axis,
+            background_image.offset_x, background_image.offset_y,
+            background_image.rotation, background_image.size,
+            background_image.use_flip_x, background_image.use_flip_y)
+
+
+def get_linked_images(context, background_images):
+    """Get, for each background image, the background images of the other
+    3D Views showing the same image along the same axis, with the same
+    transform, as (background image, area) pairs"""
+    rows = {}
+    for i, background_image in enumerate(background_images):
+        rows.setdefault(get_background_image_key(background_image),
+                        []).append(i)
+
+    linked_images = [[] for _background_image in background_images]
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+            space = area.spaces.active
+            if space == context.space_data:
+                continue
+            for background_image in space.background_images:
+                for i in rows.get(get_background_image_key(background_image),
+                                  ()):
+                    linked_images[i].append((background_image, area))
+    return linked_images
 
 
 EVENT_DIGITS = {'ZERO':          '0',
@@ -79,52 +243,2177 @@ EVENT_DIGITS = {'ZERO':          '0',
                 'NUMPAD_9':      '9',
                 'NUMPAD_PERIOD': '.'}
 
-AXIS_MAP = {
-    'TOP':       'xy',
-    'BOTTOM':    'xy',
-    'FRONT':     'xz',
-    'BACK':      'xz',
-    'LEFT':      'yz',
-    'RIGHT':     'yz',
-    'UNDEFINED': 'xy',
-}
+# Characters typed in expression mode, in addition to digits
+EVENT_EXPRESSION = {'MINUS':          '-',
+                    'NUMPAD_MINUS':   '-',
+                    'PLUS':           '+',
+                    'NUMPAD_PLUS':    '+',
+                    'NUMPAD_ASTERIX': '*',
+                    'SLASH':          '/',
+                    'NUMPAD_SLASH':   '/',
+                    'LEFT_BRACKET':   '(',
+                    'RIGHT_BRACKET':  ')',
+                    'D':              'd',
+                    'R':              'r'}
+
+# Conversion factors from angle units to degrees
+ANGLE_UNITS = {'d': 1.0,
+               'r': degrees(1.0)}
+
+
+def parse_expression(text):
+    """Evaluate an arithmetic expression of numbers, + - * / and brackets.
+    Numbers may be followed by an angle unit, converted to degrees.
+
+    Raise ValueError if the expression is invalid or incomplete.
+    """
+    position = 0
+
+    def peek():
+        return text[position] if position < len(text) else ''
+
+    def expression():
+        nonlocal position
+        value = term()
+        while peek() in ('+', '-'):
+            operator = peek()
+            position += 1
+            if operator == '+':
+                value += term()
+            else:
+                value -= term()
+        return value
+
+    def term():
+        nonlocal position
+        value = factor()
+        while peek() in ('*', '/'):
+            operator = peek()
+            position += 1
+            if operator == '*':
+                value *= factor()
+            else:
+                divisor = factor()
+                if divisor == 0.0:
+                    raise ValueError('Division by zero')
+                value /= divisor
+        return value
+
+    def factor():
+        nonlocal position
+        character = peek()
+        if character in ('+', '-'):
+            position += 1
+            value = factor()
+            return -value if character == '-' else value
+        if character == '(':
+            position += 1
+            value = expression()
+            if peek() != ')':
+                raise ValueError('Unbalanced brackets')
+            position += 1
+        else:
+            start = position
+            while peek() and peek() in '0123456789.':
+                position += 1
+            value = float(text[start:position])
+        if peek() in ANGLE_UNITS:
+            value *= ANGLE_UNITS[peek()]
+            position += 1
+        return value
+
+    value = expression()
+    if position != len(text):
+        raise ValueError('Unexpected character: %s' % text[position])
+    return value
+
+
+class NumericInput:
+    """Values typed during a transform, one per axis (Tab to switch axis).
+
+    In simple mode, minus negates and slash inverts the current axis'
+    value. Equal toggles expression mode, where operators, brackets and
+    angle units (d, r) may be typed. Leaving it clears expressions which
+    aren't plain numbers.
+    Values are only parsed when a key is typed.
+    """
+    AXES = 2
+
+    def __init__(self):
+        self.texts = [''] * self.AXES
+        self.negate = [False] * self.AXES
+        self.divide = [False] * self.AXES
+        self.values = [None] * self.AXES
+        self.axis = 0
+        self.expression = False
+
+    def __bool__(self):
+        return any(self.texts)
+
+    def handle_event(self, event):
+        """Update input from a key press. Return whether it was used"""
+        axis = self.axis
+        if event.type in EVENT_DIGITS:
+            self.texts[axis] += EVENT_DIGITS[event.type]
+            if not self.expression and self.texts[axis].count('.') > 1:
+                self.texts[axis] = self.texts[axis][:-1]
+        elif event.type == 'BACK_SPACE':
+            self.texts[axis] = self.texts[axis][:-1]
+        elif event.type == 'TAB':
+            self.axis = (axis + 1) % self.AXES
+            return True
+        elif event.type == 'EQUAL':
+            self.expression = not self.expression
+            if not self.expression:
+                # Expressions aren't parsed in simple mode
+                self.texts = [text if self.is_number(text) else ''
+                              for text in self.texts]
+        elif self.expression and event.type in EVENT_EXPRESSION:
+            self.texts[axis] += EVENT_EXPRESSION[event.type]
+        elif event.type in ('SLASH', 'NUMPAD_SLASH'):
+            self.divide[axis] = not self.divide[axis]
+        elif event.type in ('MINUS', 'NUMPAD_MINUS'):
+            self.negate[axis] = not self.negate[axis]
+        else:
+            return False
+        self.values = [self.parse(i) for i in range(self.AXES)]
+        return True
 
+    @staticmethod
+    def is_number(text):
+        try:
+            float(text)
+        except ValueError:
+            return False
+        return True
+
+    def parse(self, axis):
+        """Get the value of an axis, or None if it is empty or invalid"""
+        text = self.texts[axis]
+        if not text:
+            return None
+        try:
+            if self.expression:
+                value = parse_expression(text)
+            else:
+                value = float(text)
+            if self.negate[axis]:
+                value = -value
+            if self.divide[axis]:
+                value = 1.0 / value
+        except (ValueError, ZeroDivisionError):
+            return None
+        return value
+
+    @property
+    def value(self):
+        return self.values[0]
+
+    @property
+    def vector(self):
+        """Values of both axes, the second one defaulting to the first"""
+        x, y = self.values
+        if not self.texts[1]:
+            y = x
+        elif not self.texts[0]:
+            x = 0.0
+        if x is None or y is None:
+            return None
+        return x, y
+
+    def __str__(self):
+        texts = []
+        for axis, text in enumerate(self.texts):
+            if axis > self.axis and not any(self.texts[axis:]):
+                break
+            if self.divide[axis]:
+                text = '1/' + text
+            if self.negate[axis]:
+                text = '-' + text
+            if axis == self.axis:
+                text += '|'
+            texts.append(text)
+        return ('=' if self.expression else '') + ', '.join(texts)
+
+
+# Distance under which image snap points are snapped, in pixels
+SNAP_DISTANCE = 12
+
+# Nudge events: what they change, and their view space direction, sign of
+# their clockwise rotation, or exponent of their scale step
+NUDGE_EVENTS = {
+    'LEFT_ARROW':    ('OFFSET', (-1.0, 0.0)),
+    'RIGHT_ARROW':   ('OFFSET', (1.0, 0.0)),
+    'DOWN_ARROW':    ('OFFSET', (0.0, -1.0)),
+    'UP_ARROW':      ('OFFSET', (0.0, 1.0)),
+    'LEFT_BRACKET':  ('ROTATION', -1.0),
+    'RIGHT_BRACKET': ('ROTATION', 1.0),
+    'MINUS':         ('SIZE', -1.0),
+    'NUMPAD_MINUS':  ('SIZE', -1.0),
+    'EQUAL':         ('SIZE', 1.0),
+    'NUMPAD_PLUS':   ('SIZE', 1.0),
+}
 
-def space_to_view_vector(view, vector):
-    """Transform a 3D world vector to ortho view space."""
-    vector = getattr(vector, AXIS_MAP[view])
-    if view in {'BACK', 'LEFT'}:
-        vector.x *= -1.0
-    if view in {'BOTTOM'}:
-        vector.y *= -1.0
-    return vector
+# Nudge events which are numeric input during transforms: signs, the
+# expression toggle, and operators and brackets typed in expressions
+NUMERIC_NUDGE_EVENTS = {'EQUAL'} | (set(NUDGE_EVENTS) & set(EVENT_EXPRESSION))
+
+# View space axes of each ortho view, in world space
+VIEW_AXES = {
+    'TOP':       ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)),
+    'BOTTOM':    ((1.0, 0.0, 0.0), (0.0, -1.0, 0.0)),
+    'FRONT':     ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    'BACK':      ((-1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    'LEFT':      ((0.0, -1.0, 0.0), (0.0, 0.0, 1.0)),
+    'RIGHT':     ((0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+    'UNDEFINED': ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)),
+}
 
 
-def view_to_region_vector(region, rv3d, view, vector):
-    """Transform an ortho view vector to region space."""
-    vector_3d = Vector()
-    if view in {'BACK', 'LEFT'}:
-        vector.x *= -1.0
-    if view in {'BOTTOM'}:
-        vector.y *= -1.0
-    setattr(vector_3d, AXIS_MAP[view], vector)
-    vector = view3d_utils.location_3d_to_region_2d(region, rv3d, vector_3d)
-    return vector
+def get_camera_frame(scene):
+    """Get the corners of the scene camera's frame in world space"""
+    camera = scene.camera
+    corners = np.ones((4, 4))
+    corners[:, :3] = [tuple(corner)
+                      for corner in camera.data.view_frame(scene=scene)]
+    return (corners @ np.array(camera.matrix_world).T)[:, :3]
 
 
-def draw_callback_px(self, context):
-    """From blender's operator_modal_draw.py modal operator template"""
-    if self.do_draw:
-        bgl.glEnable(bgl.GL_BLEND)
-        bgl.glEnable(bgl.GL_LINE_STIPPLE)
-        bgl.glColor4f(0.0, 0.0, 0.0, 1.0)
-        bgl.glLineWidth(1)
+class ViewProjection:
+    """Mappings between world, view and region space in a 3D View region.
 
-        bgl.glBegin(bgl.GL_LINE_STRIP)
-        bgl.glVertex2i(int(self.draw_start.x), int(self.draw_start.y))
-        bgl.glVertex2i(int(self.draw_end.x), int(self.draw_end.y))
+    View space is the space of background image offsets: world units
+    along the view axes in ortho views, and the camera frame's largest
+    dimension (as Blender scales camera image offsets) from the frame
+    center in camera view. The mappings are computed once, and must be
+    rebuilt when the region or view changes. Points are arrays (or
+    sequences) of shape (..., 2) in view and region space, (..., 3) in
+    world space.
+    """
 
+    def __init__(self, context, orientation):
+        region = context.region
+        rv3d = context.region_data
+        self.key = self.get_key(region, rv3d)
+        self.region_size = np.array((region.width, region.height), dtype=float)
+        self.perspective_matrix = np.array(rv3d.perspective_matrix)
+
+        if rv3d.view_perspective == 'CAMERA':
+            frame = self.world_to_region(get_camera_frame(context.scene))
+            frame_min, frame_max = frame.min(axis=0), frame.max(axis=0)
+            size = (frame_max - frame_min).max()
+            origin = (frame_min + frame_max) / 2.0
+            linear = np.array(((size, 0.0), (0.0, size)))
+        else:
+            origin, x_axis, y_axis = self.world_to_region(
+                np.vstack(((0.0, 0.0, 0.0), VIEW_AXES[orientation])))
+            linear = np.column_stack((x_axis - origin, y_axis - origin))
+
+        self.view_to_region_matrix = np.column_stack((linear, origin))
+        self.pixel_size = 1.0 / np.hypot(*linear[:, 0])
+        inverse = np.linalg.inv(linear)
+        self.region_to_view_matrix = np.column_stack(
+            (inverse, -inverse @ origin))
+
+    @staticmethod
+    def get_key(region, rv3d):
+        return ((region.width, region.height)
+                + tuple(tuple(row) for row in rv3d.perspective_matrix))
+
+    def is_valid(self, context):
+        return self.key == self.get_key(context.region, context.region_data)
+
+    def world_to_region(self, points):
+        points = np.asarray(points, dtype=float)
+        clip = points @ self.perspective_matrix[:, :3].T
+        clip += self.perspective_matrix[:, 3]
+        return (clip[..., :2] / clip[..., 3:] + 1.0) * 0.5 * self.region_size
+
+    def view_to_region(self, points):
+        matrix = self.view_to_region_matrix
+        return np.asarray(points, dtype=float) @ matrix[:, :2].T + matrix[:, 2]
+
+    def region_to_view(self, points):
+        matrix = self.region_to_view_matrix
+        return np.asarray(points, dtype=float) @ matrix[:, :2].T + matrix[:, 2]
+
+    def world_to_view(self, points):
+        return self.region_to_view(self.world_to_region(points))
+
+
+# Image dimensions read from file headers, by absolute filepath
+dimensions_cache = {}
+
+
+def read_png_dimensions(f):
+    header = f.read(24)
+    if (header[:8] != b'\x89PNG\r\n\x1a\n'
+            or header[12:16] != b'IHDR'):
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def read_jpeg_dimensions(f):
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) != 2 or marker[0] != 0xff:
+            return None
+        # Skip padding
+        while marker[1] == 0xff:
+            marker = marker[1:] + f.read(1)
+            if len(marker) != 2:
+                return None
+        if 0xd0 <= marker[1] <= 0xd9 or marker[1] == 0x01:
+            # Markers without payload
+            continue
+        length, = struct.unpack('>H', f.read(2))
+        if length < 2:
+            return None
+        # Start of frame markers, except DHT, JPG and DAC
+        if (0xc0 <= marker[1] <= 0xcf
+                and marker[1] not in (0xc4, 0xc8, 0xcc)):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_tiff_dimensions(f):
+    header = f.read(8)
+    if header[:4] == b'II*\x00':
+        order = '<'
+    elif header[:4] == b'MM\x00*':
+        order = '>'
+    else:
+        return None
+    ifd_offset, = struct.unpack(order + 'I', header[4:8])
+    f.seek(ifd_offset)
+    entry_count, = struct.unpack(order + 'H', f.read(2))
+    dimensions = {}
+    for _i in range(entry_count):
+        tag, value_type, _count, value = struct.unpack(
+            order + 'HHI4s', f.read(12))
+        if tag in (256, 257):
+            if value_type == 3:  # SHORT
+                value, = struct.unpack(order + 'H', value[:2])
+            elif value_type == 4:  # LONG
+                value, = struct.unpack(order + 'I', value)
+            else:
+                return None
+            dimensions[tag] = value
+            if len(dimensions) == 2:
+                return dimensions[256], dimensions[257]
+    return None
+
+
+# Largest EXR header scanned for the data window, in bytes
+EXR_HEADER_LIMIT = 1 << 16
+
+
+def read_exr_string(f, limit=256):
+    """Read a null-terminated string, or get None if the file ends or
+    the string is longer than limit"""
+    characters = []
+    while len(characters) < limit:
+        character = f.read(1)
+        if not character:
+            return None
+        if character == b'\x00':
+            return b''.join(characters)
+        characters.append(character)
+    return None
+
+
+def read_exr_dimensions(f):
+    if f.read(8)[:4] != b'\x76\x2f\x31\x01':
+        return None
+    # Attributes are null-terminated name and type, then size and value
+    while f.tell() < EXR_HEADER_LIMIT:
+        name = read_exr_string(f)
+        if not name:
+            return None
+        value_type = read_exr_string(f)
+        if value_type is None:
+            return None
+        size, = struct.unpack('<i', f.read(4))
+        if size < 0:
+            return None
+        if name == b'dataWindow' and value_type == b'box2i':
+            x_min, y_min, x_max, y_max = struct.unpack('<4i', f.read(16))
+            return x_max - x_min + 1, y_max - y_min + 1
+        f.seek(size, os.SEEK_CUR)
+    return None
+
+
+DIMENSION_READERS = {'.png':  read_png_dimensions,
+                     '.jpg':  read_jpeg_dimensions,
+                     '.jpeg': read_jpeg_dimensions,
+                     '.tif':  read_tiff_dimensions,
+                     '.tiff': read_tiff_dimensions,
+                     '.exr':  read_exr_dimensions}
+
+
+def read_image_dimensions(filepath):
+    """Get width and height of an image file from its header,
+    or None if it can't be read"""
+    reader = DIMENSION_READERS.get(os.path.splitext(filepath)[1].lower())
+    if reader is None:
+        return None
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    key = (stat.st_size, stat.st_mtime)
+    cached = dimensions_cache.get(filepath)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    try:
+        with open(filepath, 'rb') as f:
+            dimensions = reader(f)
+    except (OSError, struct.error, ValueError, IndexError):
+        # Truncated or corrupt headers
+        dimensions = None
+    if dimensions is not None and not all(dimensions):
+        dimensions = None
+    dimensions_cache[filepath] = (key, dimensions)
+    return dimensions
+
+
+def get_image_dimensions(images):
+    """Get width and height of images without loading their pixels.
+
+    Files are read in parallel. Images already loaded, packed, generated
+    or with unreadable headers use their size from Blender instead.
+    """
+    filepaths = []
+    for image in images:
+        if (image.source == 'FILE'
+                and image.packed_file is None
+                and not image.has_data
+                and image.filepath):
+            filepaths.append(
+                bpy.path.abspath(image.filepath, library=image.library))
+        else:
+            filepaths.append(None)
+
+    to_read = [filepath for filepath in filepaths if filepath is not None]
+    if to_read:
+        with ThreadPoolExecutor(max_workers=min(8, len(to_read))) as executor:
+            read = dict(zip(to_read,
+                            executor.map(read_image_dimensions, to_read)))
+    else:
+        read = {}
+
+    dimensions = []
+    for image, filepath in zip(images, filepaths):
+        image_dimensions = read.get(filepath)
+        if image_dimensions is None:
+            image_dimensions = tuple(image.size)
+        dimensions.append(image_dimensions)
+    return dimensions
+
+
+# Low resolution proxies of image files, generated once by background
+# Blender processes and stored next to the images, named by content hash
+PROXY_DIRECTORY = 'BL_proxy'
+PROXY_SCRIPT = """
+import bpy, sys
+source, target, size = sys.argv[sys.argv.index('--') + 1:]
+image = bpy.data.images.load(source)
+width, height = image.size
+scale = int(size) / max(width, height)
+image.scale(max(1, round(width * scale)), max(1, round(height * scale)))
+image.filepath_raw = target
+image.file_format = 'PNG'
+image.save()
+"""
+
+# Proxy jobs by file path and proxy size, and their file's stat
+proxy_jobs = {}
+proxy_executor = None
+
+
+def get_file_hash(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_proxy(filepath, size, binary_path):
+    """Get the path of a proxy of an image file, no larger than size
+    pixels, generating it if it doesn't exist yet. Return None if the
+    image is small enough or the proxy can't be generated"""
+    dimensions = read_image_dimensions(filepath)
+    if dimensions is not None and max(dimensions) <= size:
+        return None
+    try:
+        directory = os.path.join(os.path.dirname(filepath), PROXY_DIRECTORY)
+        proxy_filepath = os.path.join(
+            directory, '%s_%i.png' % (get_file_hash(filepath), size))
+        if os.path.exists(proxy_filepath):
+            return proxy_filepath
+
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary_filepath = tempfile.mkstemp(suffix='.png',
+                                                      dir=directory)
+        os.close(handle)
+        try:
+            result = subprocess.run(
+                [binary_path, '--background', '--factory-startup',
+                 '--python-expr', PROXY_SCRIPT,
+                 '--', filepath, temporary_filepath, str(size)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode or not os.path.getsize(temporary_filepath):
+                return None
+            os.replace(temporary_filepath, proxy_filepath)
+        finally:
+            if os.path.exists(temporary_filepath):
+                os.remove(temporary_filepath)
+    except OSError:
+        return None
+    return proxy_filepath
+
+
+def request_proxies(images, size):
+    """Start generating proxies of images in the background, if they
+    aren't already. Return a future of the proxy path for each image,
+    or None for images without a file"""
+    global proxy_executor
+    if proxy_executor is None:
+        # Each job waits on its own process
+        proxy_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    futures = []
+    for image in images:
+        future = None
+        if (image.source == 'FILE'
+                and image.packed_file is None
+                and image.filepath):
+            filepath = bpy.path.abspath(image.filepath, library=image.library)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                stat = None
+            if stat is not None:
+                key = (stat.st_size, stat.st_mtime)
+                job = proxy_jobs.get((filepath, size))
+                if job is None or job[0] != key:
+                    job = (key, proxy_executor.submit(
+                        make_proxy, filepath, size, bpy.app.binary_path))
+                    proxy_jobs[filepath, size] = job
+                future = job[1]
+        futures.append(future)
+    return futures
+
+
+# Grayscale pyramids of image pixels, by image name
+pyramid_cache = {}
+
+# Largest dimension of the pixels images are aligned from: alignments are
+# refined at up to 512 pixels across the reference image
+ALIGN_SIZE = 1024
+
+
+def get_image_pyramid(image, size=None):
+    """Get a list of grayscale pixel arrays, from full resolution (or
+    size pixels, for larger images) down to 32 pixels, halving resolution
+    at each level. Pyramids are cached"""
+    key = (tuple(image.size), image.filepath, image.is_dirty, size)
+    cached = pyramid_cache.get(image.name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    width, height = image.size
+    source = image
+    if size is not None and max(width, height) > size:
+        # Pixels are read from a copy scaled down by Blender, instead of
+        # copying full resolution pixels to Python
+        scale = size / max(width, height)
+        width = max(1, round(width * scale))
+        height = max(1, round(height * scale))
+        source = image.copy()
+        source.scale(width, height)
+    try:
+        pixels = np.array(source.pixels[:], dtype=np.float32).reshape(
+            height, width, source.channels)
+    finally:
+        if source is not image:
+            bpy.data.images.remove(source)
+    if image.channels >= 3:
+        level = pixels[..., :3].mean(axis=2)
+    else:
+        level = pixels[..., 0].copy()
+    if image.channels in (2, 4):
+        # Transparent areas match the empty background
+        level *= pixels[..., -1]
+
+    pyramid = [level]
+    while min(level.shape) >= 64:
+        level = level[:level.shape[0] // 2 * 2, :level.shape[1] // 2 * 2]
+        level = 0.25 * (level[0::2, 0::2] + level[1::2, 0::2]
+                        + level[0::2, 1::2] + level[1::2, 1::2])
+        pyramid.append(level)
+
+    pyramid_cache[image.name] = (key, pyramid)
+    return pyramid
+
+
+def sample_bilinear(array, x, y):
+    """Sample a 2D array at fractional column x and row y coordinates,
+    with zeros outside"""
+    x0 = np.floor(x).astype(int)
+    y0 = np.floor(y).astype(int)
+    fx = x - x0
+    fy = y - y0
+    height, width = array.shape
+    padded = np.pad(array, 1, mode='constant')
+    x0 = np.clip(x0 + 1, 0, width + 1)
+    y0 = np.clip(y0 + 1, 0, height + 1)
+    x1 = np.clip(x0 + 1, 0, width + 1)
+    y1 = np.clip(y0 + 1, 0, height + 1)
+    return ((padded[y0, x0] * (1.0 - fx) + padded[y0, x1] * fx) * (1.0 - fy)
+            + (padded[y1, x0] * (1.0 - fx) + padded[y1, x1] * fx) * fy)
+
+
+def render_image(pyramid, rectangle, flip, grid_x, grid_y, spacing):
+    """Sample an image transformed by its rectangle (center, half extents
+    and clockwise rotation) at view space grid points. Return the samples
+    and a mask of the points the image covers"""
+    center, half_extents, rotation = rectangle
+
+    # Use the pyramid level closest to the grid's resolution
+    texel = 2.0 * half_extents[0] / pyramid[0].shape[1]
+    level = int(np.clip(np.log2(max(spacing / texel, 1.0)),
+                        0, len(pyramid) - 1))
+    pixels = pyramid[level]
+    height, width = pixels.shape
+
+    # Express grid points in the image's unrotated space
+    dx = grid_x - center[0]
+    dy = grid_y - center[1]
+    cos_r, sin_r = np.cos(rotation), np.sin(rotation)
+    local_x = (dx * cos_r - dy * sin_r) / half_extents[0]
+    local_y = (dx * sin_r + dy * cos_r) / half_extents[1]
+    if flip[0]:
+        local_x = -local_x
+    if flip[1]:
+        local_y = -local_y
+    coverage = (np.abs(local_x) < 1.0) & (np.abs(local_y) < 1.0)
+    return (sample_bilinear(pixels,
+                            (local_x + 1.0) * 0.5 * width - 0.5,
+                            (local_y + 1.0) * 0.5 * height - 0.5),
+            coverage)
+
+
+def phase_correlation(a, b):
+    """Get the (row, column) shift of b relative to a, with subpixel
+    precision, and the correlation peak value"""
+    cross_power = np.fft.fft2(b) * np.conj(np.fft.fft2(a))
+    cross_power /= np.abs(cross_power) + 1e-12
+    correlation = np.fft.ifft2(cross_power).real
+    peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+    shift = []
+    for axis, (position, length) in enumerate(zip(peak, correlation.shape)):
+        # Parabolic interpolation around the peak
+        before = list(peak)
+        after = list(peak)
+        before[axis] = (position - 1) % length
+        after[axis] = (position + 1) % length
+        c0, c1, c2 = (correlation[tuple(before)], correlation[peak],
+                      correlation[tuple(after)])
+        denominator = c0 - 2.0 * c1 + c2
+        subpixel = 0.5 * (c0 - c2) / denominator if denominator else 0.0
+        if position > length // 2:
+            position -= length
+        shift.append(position + subpixel)
+    return np.array(shift), correlation[peak]
+
+
+def log_polar_spectrum(image, size):
+    """Get the magnitude spectrum of an image resampled in log-polar
+    coordinates (rows are angles in [0, pi), columns log radii),
+    and the log base of radii"""
+    height, width = image.shape
+    window = np.outer(np.hanning(height), np.hanning(width))
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2(image * window)))
+
+    # High-pass filter, so that low frequencies don't dominate
+    fy = np.cos(np.pi * np.linspace(-0.5, 0.5, height))[:, np.newaxis]
+    fx = np.cos(np.pi * np.linspace(-0.5, 0.5, width))[np.newaxis, :]
+    spectrum *= 1.0 - fy * fx
+
+    max_radius = min(height, width) / 2.0
+    log_base = np.exp(np.log(max_radius) / size)
+    radii = log_base ** np.arange(size)
+    angles = np.linspace(0.0, np.pi, size, endpoint=False)[:, np.newaxis]
+    return (sample_bilinear(spectrum,
+                            width // 2 + radii * np.cos(angles),
+                            height // 2 + radii * np.sin(angles)),
+            log_base)
+
+
+def similarity_rectangle(rectangle, pivot, angle, factor, offset):
+    """Apply a similarity (clockwise rotation by angle and scale around
+    a pivot, then offset) to an image rectangle"""
+    center, half_extents, rotation = rectangle
+    relative = center - pivot
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    rotated = np.array((relative[0] * cos_a + relative[1] * sin_a,
+                        -relative[0] * sin_a + relative[1] * cos_a))
+    return (pivot + factor * rotated + offset,
+            half_extents * factor,
+            rotation + angle)
+
+
+def refine_similarity(ref_pixels, pixels, mask, grid_x, grid_y, pivot,
+                      spacing):
+    """Get a small similarity (offset, clockwise angle and scale change
+    around the pivot) moving pixels closer to ref_pixels, with a
+    Gauss-Newton step over the masked grid points"""
+    gradient_y, gradient_x = np.gradient(pixels, spacing)
+    relative_x = np.broadcast_to(grid_x - pivot[0], pixels.shape)
+    relative_y = np.broadcast_to(grid_y - pivot[1], pixels.shape)
+    jacobian = np.stack((gradient_x, gradient_y,
+                         gradient_x * relative_y - gradient_y * relative_x,
+                         gradient_x * relative_x + gradient_y * relative_y),
+                        axis=-1)[mask]
+    if len(jacobian) < 4:
+        return np.zeros(2), 0.0, 1.0
+    step = np.linalg.lstsq(jacobian, (pixels - ref_pixels)[mask],
+                           rcond=-1)[0]
+    return step[:2], step[2], 1.0 + step[3]
+
+
+def estimate_alignment(reference, moving, size=128, levels=3, iterations=3):
+    """Estimate the similarity aligning a moving image onto a reference
+    image: rotation and scale from the phase correlation of log-polar
+    magnitude spectra, translation from the phase correlation of the
+    images, then all of them refined from coarse to fine resolutions.
+
+    Images are given as (pyramid, rectangle, flip) tuples, rectangles as
+    (center, half extents, rotation) in view space. Return the pivot,
+    clockwise angle, scale factor and offset of the similarity.
+    """
+    ref_pyramid, ref_rectangle, ref_flip = reference
+    pyramid, rectangle, flip = moving
+    pivot = ref_rectangle[0]
+    extent = 2.0 * ref_rectangle[1].max()
+
+    def render_pair(resolution, angle, factor, offset):
+        spacing = extent / resolution
+        steps = (np.arange(resolution) - (resolution - 1) / 2.0) * spacing
+        grid_x = pivot[0] + steps[np.newaxis, :]
+        grid_y = pivot[1] + steps[:, np.newaxis]
+        ref_pixels, ref_mask = render_image(ref_pyramid, ref_rectangle,
+                                            ref_flip, grid_x, grid_y, spacing)
+        pixels, mask = render_image(pyramid,
+                                    similarity_rectangle(rectangle, pivot,
+                                                         angle, factor,
+                                                         offset),
+                                    flip, grid_x, grid_y, spacing)
+        return ref_pixels, pixels, ref_mask & mask, grid_x, grid_y, spacing
+
+    # Rotation and scale
+    ref_pixels, pixels, _mask, _x, _y, spacing = render_pair(
+        size, 0.0, 1.0, np.zeros(2))
+    ref_log_polar, log_base = log_polar_spectrum(ref_pixels, size)
+    log_polar, _log_base = log_polar_spectrum(pixels, size)
+    (angle_shift, radius_shift), _peak = phase_correlation(
+        log_polar, ref_log_polar)
+    angle = -angle_shift * np.pi / size
+    factor = log_base ** -radius_shift
+
+    # The spectrum is symmetric: try both opposite angles,
+    # and keep the one with the best translation match
+    best = None
+    for candidate in (angle, angle + np.pi):
+        ref_pixels, pixels, _mask, _x, _y, spacing = render_pair(
+            size, candidate, factor, np.zeros(2))
+        shift, peak = phase_correlation(pixels, ref_pixels)
+        if best is None or peak > best[0]:
+            best = peak, candidate, shift[::-1] * spacing
+    _peak, angle, offset = best
+
+    # Refine at increasing resolutions
+    for level in range(levels):
+        for _iteration in range(iterations):
+            ref_pixels, pixels, mask, grid_x, grid_y, spacing = render_pair(
+                size * 2 ** level, angle, factor, offset)
+            step_offset, step_angle, step_factor = refine_similarity(
+                ref_pixels, pixels, mask, grid_x, grid_y, pivot, spacing)
+            # Compose the step after the current similarity
+            cos_a, sin_a = np.cos(step_angle), np.sin(step_angle)
+            offset = step_factor * np.array(
+                (offset[0] * cos_a + offset[1] * sin_a,
+                 -offset[0] * sin_a + offset[1] * cos_a)) + step_offset
+            angle += step_angle
+            factor *= step_factor
+
+    angle = (angle + np.pi) % (2.0 * np.pi) - np.pi
+    return pivot, angle, factor, offset
+
+
+def move_pixels(pixels, angle, offset):
+    """Turn the contents of a grayscale array (rows going up) clockwise by
+    angle around its center, then move them by an (x, y) offset in pixels,
+    with zeros outside"""
+    height, width = pixels.shape
+    y, x = np.mgrid[0:height, 0:width]
+    dx = x - offset[0] - (width - 1) / 2.0
+    dy = y - offset[1] - (height - 1) / 2.0
+    # Sample where each pixel comes from, turning counterclockwise
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    return sample_bilinear(pixels,
+                           (width - 1) / 2.0 + dx * cos_a - dy * sin_a,
+                           (height - 1) / 2.0 + dx * sin_a + dy * cos_a)
+
+
+def estimate_frame_motion(reference, pixels, rotation=False, iterations=5):
+    """Estimate the motion of a frame's contents relative to a reference
+    frame, both grayscale arrays of the same shape (rows going up).
+
+    Return the clockwise angle the contents turned by around the frame's
+    center, and the (x, y) translation in pixels of the contents once
+    turned back. The angle comes from the phase correlation of log-polar
+    magnitude spectra, if rotation is estimated, the translation from the
+    phase correlation of the frames, then both are refined.
+    """
+    angle = 0.0
+    if rotation:
+        size = min(reference.shape)
+        ref_log_polar, _log_base = log_polar_spectrum(reference, size)
+        log_polar, _log_base = log_polar_spectrum(pixels, size)
+        (angle_shift, _radius_shift), _peak = phase_correlation(
+            ref_log_polar, log_polar)
+        # Spectra are symmetric: keep the smallest of opposite angles
+        angle = -angle_shift * np.pi / size
+        angle = (angle + np.pi / 2.0) % np.pi - np.pi / 2.0
+    window = np.outer(np.hanning(reference.shape[0]),
+                      np.hanning(reference.shape[1]))
+    (shift_y, shift_x), _peak = phase_correlation(
+        reference * window, move_pixels(pixels, -angle, (0.0, 0.0)) * window)
+    offset = np.array((shift_x, shift_y))
+
+    # Refine the frame's contents moved back onto the reference
+    height, width = reference.shape
+    grid_y, grid_x = np.mgrid[0:height, 0:width].astype(float)
+    center = np.array(((width - 1) / 2.0, (height - 1) / 2.0))
+    covered = np.ones_like(reference)
+    for _iteration in range(iterations):
+        aligned = move_pixels(pixels, -angle, -offset)
+        mask = move_pixels(covered, -angle, -offset) > 0.999
+        step_offset, step_angle, _step_factor = refine_similarity(
+            reference, aligned, mask, grid_x, grid_y, center, 1.0)
+        cos_a, sin_a = np.cos(step_angle), np.sin(step_angle)
+        offset = np.array((offset[0] * cos_a + offset[1] * sin_a,
+                           -offset[0] * sin_a + offset[1] * cos_a)
+                          ) - step_offset
+        if rotation:
+            angle -= step_angle
+    return offset, angle
+
+
+class BackgroundImageBatch:
+    """Initial transforms of background images, stored as arrays
+    (one row per image) so that all images are transformed in one pass"""
+
+    def __init__(self, background_images, camera=False, dimensions=None,
+                 values=None):
+        """Image dimensions and values, as read by
+        read_background_image_values(), are read from the images if not
+        given"""
+        self.images = list(background_images)
+        count = len(self.images)
+        if dimensions is None:
+            dimensions = get_image_dimensions(
+                [bgi.image for bgi in self.images])
+        self.ratio = np.array([width / height
+                               for width, height in dimensions],
+                              dtype=float).reshape(count)
+        if values is None:
+            self.initial_location = np.empty((count, 2))
+            self.initial_rotation = np.empty(count)
+            self.initial_size = np.empty(count)
+            self.initial_flip = np.empty((count, 2), dtype=bool)
+            for i, bgi in enumerate(self.images):
+                self.initial_location[i] = bgi.offset_x, bgi.offset_y
+                self.initial_rotation[i] = bgi.rotation
+                self.initial_size[i] = bgi.size
+                self.initial_flip[i] = bgi.use_flip_x, bgi.use_flip_y
+        else:
+            (self.initial_location, self.initial_rotation,
+             self.initial_size, self.initial_flip) = values
+
+        # In ortho views, offsets are expressed as a factor of width or
+        # height, view space is not. In camera view, both are expressed
+        # as a factor of the camera frame's largest dimension
+        if camera:
+            self.ratio[:] = 1.0
+        self.initial_location_view = self.initial_location.copy()
+        self.initial_location_view[:, 1] /= self.ratio
+
+        # Last values written to the images, and journal of the images
+        # written to since the last restore
+        self.location = self.initial_location.copy()
+        self.rotation = self.initial_rotation.copy()
+        self.size = self.initial_size.copy()
+        self.flip = self.initial_flip.copy()
+        self.touched = np.zeros(count, dtype=bool)
+        # Number of writes to each image, to know when to redraw outlines
+        self.revisions = np.zeros(count, dtype=int)
+        # Values the images hold, while writes are kept in the batch
+        self.committed = None
+
+        # Background images of other views written along with each image,
+        # and the areas of those written to since last asked
+        self.linked_images = [()] * count
+        self.changed_areas = set()
+
+        # Images of the background images, and the images shown instead
+        self.source_images = [bgi.image for bgi in self.images]
+        self.shown_images = list(self.source_images)
+
+    def __len__(self):
+        return len(self.images)
+
+    def _write(self, attributes, current, indices, values):
+        """Set the images' properties whose values differ from the last
+        written ones, and record these images as touched. Return the
+        number of properties set"""
+        values = values.reshape(len(indices), len(attributes))
+        current = current.reshape(len(current), len(attributes))
+        changed = values != current[indices]
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            return 0
+        changed_indices = indices[rows]
+        if self.committed is not None:
+            # Deferred until commit()
+            current[changed_indices] = values[rows]
+            self.touched[changed_indices] = True
+            self.revisions[changed_indices] += 1
+            return 0
+        for i, row_values, row_changed in zip(changed_indices.tolist(),
+                                              values[rows].tolist(),
+                                              changed[rows].tolist()):
+            image = self.images[i]
+            for attribute, value, is_changed in zip(
+                    attributes, row_values, row_changed):
+                if is_changed:
+                    setattr(image, attribute, value)
+            for linked_image, area in self.linked_images[i]:
+                for attribute, value, is_changed in zip(
+                        attributes, row_values, row_changed):
+                    if is_changed:
+                        setattr(linked_image, attribute, value)
+                self.changed_areas.add(area)
+        current[changed_indices] = values[rows]
+        self.touched[changed_indices] = True
+        self.revisions[changed_indices] += 1
+        return int(changed[rows].sum())
+
+    def write_locations(self, indices, locations):
+        return self._write(('offset_x', 'offset_y'), self.location, indices,
+                           locations)
+
+    def write_rotations(self, indices, rotations):
+        return self._write(('rotation',), self.rotation, indices, rotations)
+
+    def write_sizes(self, indices, sizes):
+        return self._write(('size',), self.size, indices, sizes)
+
+    def write_flips(self, indices, flips):
+        return self._write(('use_flip_x', 'use_flip_y'), self.flip, indices,
+                           flips)
+
+    def get_state(self):
+        """Get copies of the last written values"""
+        return (self.location.copy(), self.rotation.copy(), self.size.copy(),
+                self.flip.copy())
+
+    def set_state(self, state):
+        """Write values got from get_state() to the images. Return the
+        number of properties set"""
+        indices = np.arange(len(self))
+        location, rotation, size, flip = state
+        return (self.write_locations(indices, location)
+                + self.write_rotations(indices, rotation)
+                + self.write_sizes(indices, size)
+                + self.write_flips(indices, flip))
+
+    def rebase(self):
+        """Make the last written values the initial ones, which transforms
+        start from and restore() sets back"""
+        self.initial_location = self.location.copy()
+        self.initial_rotation = self.rotation.copy()
+        self.initial_size = self.size.copy()
+        self.initial_flip = self.flip.copy()
+        self.initial_location_view = self.initial_location.copy()
+        self.initial_location_view[:, 1] /= self.ratio
+
+    def restore(self):
+        """Set the touched images' properties back to their initial values"""
+        indices = np.flatnonzero(self.touched)
+        self.write_locations(indices, self.initial_location[indices])
+        self.write_rotations(indices, self.initial_rotation[indices])
+        self.write_sizes(indices, self.initial_size[indices])
+        self.write_flips(indices, self.initial_flip[indices])
+        self.touched[:] = False
+
+    def defer_writes(self):
+        """Keep values written from now on in the batch only, without
+        setting the images' properties until commit()"""
+        if self.committed is None:
+            self.committed = self.get_state()
+
+    def get_pending(self):
+        """Get the indices of the images whose values written since
+        defer_writes() differ from their properties"""
+        if self.committed is None:
+            return np.empty(0, dtype=int)
+        location, rotation, size, flip = self.committed
+        return np.flatnonzero((self.location != location).any(axis=1)
+                              | (self.rotation != rotation)
+                              | (self.size != size)
+                              | (self.flip != flip).any(axis=1))
+
+    def commit(self):
+        """Set the properties of the images, and linked images, whose
+        values were written since defer_writes(), in one pass, and write
+        directly again. Return the number of properties set"""
+        if self.committed is None:
+            return 0
+        state = self.get_state()
+        self.location, self.rotation, self.size, self.flip = self.committed
+        self.committed = None
+        return self.set_state(state)
+
+    def link(self, linked_images):
+        """Set the background images of other views to write along with
+        each image, as lists of (background image, area) pairs"""
+        self.linked_images = linked_images
+
+    def pop_changed_areas(self):
+        """Get the areas of linked images written to since last called"""
+        changed_areas = self.changed_areas
+        self.changed_areas = set()
+        return changed_areas
+
+    def show_images(self, images):
+        """Show other images (by background image index) instead of the
+        background images' own, and their own images for the others"""
+        for i, bgi in enumerate(self.images):
+            image = images.get(i, self.source_images[i])
+            if self.shown_images[i] != image:
+                bgi.image = image
+                for linked_image, area in self.linked_images[i]:
+                    linked_image.image = image
+                    self.changed_areas.add(area)
+                self.shown_images[i] = image
+
+    def similarity(self, indices, pivot_point, angle, factor, offset):
+        """Get locations, rotations and sizes of the images rotated
+        clockwise and scaled around a pivot, then moved by a view space
+        offset"""
+        relative = self.initial_location_view[indices] - pivot_point
+        cos_a, sin_a = np.cos(angle), np.sin(angle)
+        locations = pivot_point + offset + factor * np.column_stack((
+            relative[:, 0] * cos_a + relative[:, 1] * sin_a,
+            -relative[:, 0] * sin_a + relative[:, 1] * cos_a))
+        locations[:, 1] *= self.ratio[indices]
+        return (locations,
+                self.initial_rotation[indices] + angle,
+                self.initial_size[indices] * factor)
+
+    def affine(self, indices, pivot_points, matrix, offset):
+        """Get locations, rotations, sizes and flips of the images
+        transformed by a 2x2 view space matrix around pivots (one for all
+        images, or one per image), then moved by an offset.
+
+        Images can only be rotated, scaled uniformly and mirrored, so the
+        matrix is reduced to the closest such transform.
+        """
+        matrix = np.asarray(matrix, dtype=float)
+        determinant = np.linalg.det(matrix)
+        mirror = determinant < 0.0
+        if mirror:
+            # Mirror along the view's Y axis first
+            matrix = matrix * (1.0, -1.0)
+        angle = np.arctan2(matrix[0, 1] - matrix[1, 0],
+                           matrix[0, 0] + matrix[1, 1])
+        factor = np.sqrt(abs(determinant))
+
+        relative = self.initial_location_view[indices] - pivot_points
+        rotations = self.initial_rotation[indices]
+        flips = self.initial_flip[indices].copy()
+        if mirror:
+            relative[:, 1] = -relative[:, 1]
+            rotations = -rotations
+            flips[:, 1] = ~flips[:, 1]
+
+        cos_a, sin_a = np.cos(angle), np.sin(angle)
+        locations = pivot_points + offset + factor * np.column_stack((
+            relative[:, 0] * cos_a + relative[:, 1] * sin_a,
+            -relative[:, 0] * sin_a + relative[:, 1] * cos_a))
+        locations[:, 1] *= self.ratio[indices]
+        return (locations, rotations + angle,
+                self.initial_size[indices] * factor, flips)
+
+    def initial_rectangles(self):
+        """Get centers and half extents in view space, and rotations,
+        of the images' rectangles before transformation"""
+        half_extents = np.column_stack(
+            (self.initial_size, self.initial_size / self.ratio))
+        return (self.initial_location_view, half_extents,
+                self.initial_rotation)
+
+    def rectangles(self, indices):
+        """Get centers and half extents in view space, and rotations,
+        of the images' rectangles as last written"""
+        ratio = self.ratio[indices]
+        centers = self.location[indices]
+        centers[:, 1] /= ratio
+        size = self.size[indices]
+        return (centers, np.column_stack((size, size / ratio)),
+                self.rotation[indices])
+
+    @staticmethod
+    def corners(centers, half_extents, rotations):
+        """Get the four corners of rectangles, rotated clockwise
+        around their centers"""
+        signs = np.array(((-1.0, -1.0), (1.0, -1.0), (1.0, 1.0), (-1.0, 1.0)))
+        local = signs * half_extents[:, np.newaxis, :]
+        cos_r = np.cos(rotations)[:, np.newaxis]
+        sin_r = np.sin(rotations)[:, np.newaxis]
+        return centers[:, np.newaxis, :] + np.stack(
+            (local[..., 0] * cos_r + local[..., 1] * sin_r,
+             -local[..., 0] * sin_r + local[..., 1] * cos_r), axis=-1)
+
+    @staticmethod
+    def snap_points(centers, half_extents, rotations):
+        """Get the corners, edge midpoints and center of rectangles"""
+        signs = np.array(((-1.0, -1.0), (0.0, -1.0), (1.0, -1.0),
+                          (-1.0, 0.0), (0.0, 0.0), (1.0, 0.0),
+                          (-1.0, 1.0), (0.0, 1.0), (1.0, 1.0)))
+        local = signs * half_extents[:, np.newaxis, :]
+        cos_r = np.cos(rotations)[:, np.newaxis]
+        sin_r = np.sin(rotations)[:, np.newaxis]
+        return centers[:, np.newaxis, :] + np.stack(
+            (local[..., 0] * cos_r + local[..., 1] * sin_r,
+             -local[..., 0] * sin_r + local[..., 1] * cos_r), axis=-1)
+
+    def bounds(self, indices):
+        """Get the lower left and upper right corners of the images'
+        bounding boxes before transformation, in view space"""
+        centers, half_extents, rotations = self.initial_rectangles()
+        corners = self.corners(centers[indices], half_extents[indices],
+                               rotations[indices])
+        return corners.min(axis=1), corners.max(axis=1)
+
+    def offset(self, indices, offsets):
+        """Get locations of the images moved by view space offsets, one
+        per image"""
+        locations = self.initial_location_view[indices] + offsets
+        locations[:, 1] *= self.ratio[indices]
+        return locations
+
+    def median_point(self, indices):
+        """Mean of the images' locations in view space"""
+        return self.initial_location_view[indices].mean(axis=0)
+
+    def translate(self, indices, offset, constrain_x=False, constrain_y=False):
+        """Get locations of the images moved by a view space offset"""
+        offset = np.tile(np.asarray(offset, dtype=float), (len(indices), 1))
+        offset[:, 1] *= self.ratio[indices]
+
+        # Axis constraint
+        if constrain_x:
+            offset[:, 1] = 0.0
+        if constrain_y:
+            offset[:, 0] = 0.0
+
+        return self.initial_location[indices] + offset
+
+    def polar_coordinates(self, indices, pivot_point):
+        """Get angles and distances of the images around a pivot,
+        in view space"""
+        relative = self.initial_location_view[indices] - pivot_point
+        return (np.arctan2(relative[:, 1], relative[:, 0]),
+                np.hypot(relative[:, 0], relative[:, 1]))
+
+    def rotate(self, indices, pivot_point, angle, polar=None):
+        """Get locations and rotations of the images rotated around a pivot.
+
+        If the images' polar coordinates around the pivot are given,
+        images not located on the pivot are translated in a circular path
+        around it.
+        """
+        locations = self.initial_location[indices].copy()
+        if polar is not None:
+            initial_angle, distance = polar
+            orbiting = distance != 0.0
+            orbit_locations = np.column_stack((
+                pivot_point[0]
+                + np.cos(initial_angle - angle) * distance,
+                (pivot_point[1]
+                 + np.sin(initial_angle - angle) * distance)
+                * self.ratio[indices]))
+            locations[orbiting] = orbit_locations[orbiting]
+        return locations, self.initial_rotation[indices] + angle
+
+    def scale(self, indices, pivot_point, factor, flip=False, moving=None):
+        """Get locations, sizes and flips of the images scaled from a pivot.
+
+        Images selected by the moving mask are translated along the line
+        between the pivot and their original location. A flip is a
+        negative scale, applied by toggling the images' flip options.
+        """
+        locations = self.initial_location[indices].copy()
+        flips = self.initial_flip[indices].copy()
+        if flip:
+            flips = ~flips
+        if moving is not None and np.any(moving):
+            view = self.initial_location_view[indices]
+            moved = (view + (pivot_point - view)
+                     * (1.0 - factor * (-1.0 if flip else 1.0)))
+            moved[:, 1] *= self.ratio[indices]
+            locations[moving] = moved[moving]
+        return locations, self.initial_size[indices] * factor, flips
+
+
+class ImageGrid:
+    """Uniform grid over the bounding boxes of image rectangles,
+    to find the images under a point in view space"""
+
+    def __init__(self, rectangles):
+        self.rectangles = rectangles
+        corners = BackgroundImageBatch.corners(*rectangles)
+        self.bounds_min = corners.min(axis=1)
+        bounds_max = corners.max(axis=1)
+
+        # Cells about the size of a typical image
+        extents = (bounds_max - self.bounds_min).max(axis=1)
+        self.cell_size = max(float(np.median(extents)), 1e-6)
+        self.origin = self.bounds_min.min(axis=0)
+
+        self.cells = {}
+        cells_min = self.get_cell(self.bounds_min)
+        cells_max = self.get_cell(bounds_max)
+        for i, ((x_min, y_min), (x_max, y_max)) in enumerate(
+                zip(cells_min.tolist(), cells_max.tolist())):
+            for x in range(x_min, x_max + 1):
+                for y in range(y_min, y_max + 1):
+                    self.cells.setdefault((x, y), []).append(i)
+
+    def get_cell(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(int)
+
+    def query(self, point):
+        """Get indices of the images containing a point,
+        from the top one (drawn last) to the bottom one"""
+        candidates = np.array(
+            self.cells.get(tuple(self.get_cell(point).tolist()), ()),
+            dtype=int)
+        if not len(candidates):
+            return candidates
+        centers, half_extents, rotations = (
+            array[candidates] for array in self.rectangles)
+
+        # Express point in the images' unrotated space
+        relative = np.asarray(point) - centers
+        cos_r, sin_r = np.cos(rotations), np.sin(rotations)
+        local_x = relative[:, 0] * cos_r - relative[:, 1] * sin_r
+        local_y = relative[:, 0] * sin_r + relative[:, 1] * cos_r
+        inside = ((np.abs(local_x) <= half_extents[:, 0])
+                  & (np.abs(local_y) <= half_extents[:, 1]))
+        return candidates[inside][::-1]
+
+
+def get_image_slots(background_images, active_image=0):
+    """Get the background images which have an image, as the others
+    can't be measured, and the index among them of the active one, or
+    None if it has no image"""
+    slots = []
+    active = None
+    for i, background_image in enumerate(background_images):
+        if background_image.image is not None:
+            if i == active_image:
+                active = len(slots)
+            slots.append(background_image)
+    return slots, active
+
+
+def transform_background_images(background_images, offset=(0.0, 0.0),
+                                angle=0.0, factor=1.0, matrix=None,
+                                pivot_point='MEDIAN_POINT',
+                                cursor=(0.0, 0.0), active_image=0,
+                                camera=False):
+    """Transform background images in one pass, around a pivot point as
+    the interactive operator does.
+
+    The images are rotated clockwise by angle (in radians) and scaled by
+    factor around the pivot, then moved by offset, all in view space:
+    world units along the view axes in ortho views, the camera frame's
+    largest dimension in camera view. Alternatively, matrix is a 2x2 (or
+    2x3, translation included) view space matrix, applied around the
+    pivot.
+
+    pivot_point is one of the 3D View pivot point modes. The 3D cursor is
+    given in view space, and the active image as an index into
+    background_images. Background images without an image are left out.
+    Return the batch of images, which can restore them.
+    """
+    background_images, active_image = get_image_slots(background_images,
+                                                      active_image)
+    if pivot_point == 'ACTIVE_ELEMENT' and active_image is None:
+        raise ValueError('The active background image has no image')
+    batch = BackgroundImageBatch(background_images, camera=camera)
+    indices = np.arange(len(batch))
+    offset = np.asarray(offset, dtype=float)
+    if matrix is None:
+        matrix = factor * np.array(((np.cos(angle), np.sin(angle)),
+                                    (-np.sin(angle), np.cos(angle))))
+    else:
+        matrix = np.asarray(matrix, dtype=float)
+        if matrix.shape == (2, 3):
+            offset = offset + matrix[:, 2]
+            matrix = matrix[:, :2]
+
+    if pivot_point == 'CURSOR':
+        pivot_points = np.asarray(cursor, dtype=float)
+    elif pivot_point in ('BOUNDING_BOX_CENTER', 'MEDIAN_POINT'):
+        pivot_points = batch.median_point(indices)
+    elif pivot_point == 'ACTIVE_ELEMENT':
+        pivot_points = batch.initial_location_view[active_image]
+    elif pivot_point == 'INDIVIDUAL_ORIGINS':
+        pivot_points = batch.initial_location_view
+    else:
+        raise ValueError('Unknown pivot point: %s' % pivot_point)
+
+    locations, rotations, sizes, flips = batch.affine(
+        indices, pivot_points, matrix, offset)
+    batch.write_locations(indices, locations)
+    batch.write_rotations(indices, rotations)
+    batch.write_sizes(indices, sizes)
+    batch.write_flips(indices, flips)
+    return batch
+
+
+def get_edges(mins, maxs, axis, edge):
+    """Get the minimum, center or maximum edges of bounding boxes along
+    an axis (0 or 1)"""
+    if edge == 'MIN':
+        return mins[:, axis]
+    elif edge == 'MAX':
+        return maxs[:, axis]
+    return (mins[:, axis] + maxs[:, axis]) / 2.0
+
+
+def align_bounds(mins, maxs, axis, edge, target):
+    """Get view space offsets aligning the minimum, center or maximum
+    edges of bounding boxes along an axis onto a target value"""
+    offsets = np.zeros_like(mins)
+    offsets[:, axis] = target - get_edges(mins, maxs, axis, edge)
+    return offsets
+
+
+def distribute_bounds(mins, maxs, axis):
+    """Get view space offsets spacing bounding boxes evenly along an axis,
+    between the first and last ones, which stay in place"""
+    offsets = np.zeros_like(mins)
+    if len(mins) < 3:
+        return offsets
+    order = np.argsort((mins[:, axis] + maxs[:, axis]) / 2.0,
+                       kind='mergesort')
+    lengths = (maxs - mins)[order, axis]
+    start = mins[order[0], axis]
+    gap = ((maxs[order[-1], axis] - start - lengths.sum())
+           / (len(order) - 1))
+    new_mins = start + np.concatenate(((0.0,), np.cumsum(lengths + gap)[:-1]))
+    offsets[order, axis] = new_mins - mins[order, axis]
+    return offsets
+
+
+def grid_bounds(mins, maxs, order, columns=0, spacing=0.0):
+    """Get view space offsets arranging bounding boxes in a grid of equal
+    cells, in the given order, row by row from the selection's top left
+    corner. With 0 columns, the grid is about square"""
+    count = len(mins)
+    if columns <= 0:
+        columns = int(np.ceil(np.sqrt(count)))
+    cell = (maxs - mins).max(axis=0) + spacing
+    ranks = np.empty(count, dtype=int)
+    ranks[order] = np.arange(count)
+    cell_centers = np.column_stack((
+        mins[:, 0].min() + (ranks % columns + 0.5) * cell[0],
+        maxs[:, 1].max() - (ranks // columns + 0.5) * cell[1]))
+    return cell_centers - (mins + maxs) / 2.0
+
+
+def pack_bounds(mins, maxs, spacing=0.0):
+    """Get view space offsets packing bounding boxes without overlap, on
+    shelves filled by decreasing height (Next-Fit Decreasing Height) from
+    the selection's top left corner, in a strip about as wide as the
+    packing is high"""
+    sizes = maxs - mins + spacing
+    width = max(sizes[:, 0].max(), np.sqrt((sizes[:, 0] * sizes[:, 1]).sum()))
+    order = np.argsort(-sizes[:, 1], kind='mergesort')
+    new_mins = np.empty_like(mins)
+    x = 0.0
+    shelf_top = 0.0
+    shelf_height = None
+    for i, (box_width, box_height) in zip(order.tolist(),
+                                          sizes[order].tolist()):
+        if shelf_height is None or x + box_width > width:
+            # Shelves are as high as their first, highest box
+            if shelf_height is not None:
+                shelf_top -= shelf_height
+            x = 0.0
+            shelf_height = box_height
+        new_mins[i] = x, shelf_top - box_height
+        x += box_width
+    origin = np.array((mins[:, 0].min(), maxs[:, 1].max()))
+    return origin + new_mins - mins
+
+
+def layout_background_images(background_images, mode='GRID', axis='X',
+                             edge='MIN', columns=0, spacing=0.0,
+                             order='POSITION', relative_to='SELECTION',
+                             active_image=0, camera=False):
+    """Lay out background images in one pass, by moving them in view
+    space, their bounding boxes including their rotations.
+
+    mode is one of:
+    - 'ALIGN': align the images' edge ('MIN', 'CENTER' or 'MAX') along
+      axis ('X' or 'Y') to that of the selection, or of the active image
+      with relative_to 'ACTIVE'
+    - 'DISTRIBUTE': space the images evenly along axis
+    - 'GRID': arrange the images in a grid, ordered by 'POSITION' (rows
+      from top to bottom) or by image 'NAME', with columns (0 for about
+      square) and spacing between cells
+    - 'PACK': pack the images without overlap, with spacing between them
+
+    Background images without an image are left out. Return the batch of
+    images, which can restore them.
+    """
+    background_images, active_image = get_image_slots(background_images,
+                                                      active_image)
+    if relative_to == 'ACTIVE' and active_image is None:
+        raise ValueError('The active background image has no image')
+    batch = BackgroundImageBatch(background_images, camera=camera)
+    indices = np.arange(len(batch))
+    if not len(batch):
+        return batch
+    mins, maxs = batch.bounds(indices)
+    axis_index = 'XY'.index(axis)
+
+    if mode == 'ALIGN':
+        if relative_to == 'ACTIVE':
+            target = get_edges(mins, maxs, axis_index, edge)[active_image]
+        else:
+            # Edge of the selection's bounding box
+            target = get_edges(mins.min(axis=0, keepdims=True),
+                               maxs.max(axis=0, keepdims=True),
+                               axis_index, edge)[0]
+        offsets = align_bounds(mins, maxs, axis_index, edge, target)
+    elif mode == 'DISTRIBUTE':
+        offsets = distribute_bounds(mins, maxs, axis_index)
+    elif mode == 'GRID':
+        if order == 'NAME':
+            grid_order = sorted(indices.tolist(),
+                                key=lambda i: batch.source_images[i].name)
+        else:
+            centers = (mins + maxs) / 2.0
+            grid_order = np.lexsort((centers[:, 0], -centers[:, 1]))
+        offsets = grid_bounds(mins, maxs, grid_order, columns, spacing)
+    elif mode == 'PACK':
+        offsets = pack_bounds(mins, maxs, spacing)
+    else:
+        raise ValueError('Unknown layout mode: %s' % mode)
+
+    batch.write_locations(indices, batch.offset(indices, offsets))
+    return batch
+
+
+def simplify_curve(times, values, tolerance):
+    """Get the indices of the points of a curve to keep so that, linearly
+    interpolated, it stays within tolerance of the values
+    (Ramer-Douglas-Peucker, with distances along the value axis)"""
+    keep = np.zeros(len(times), dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, len(times) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        interpolated = values[first] + (
+            (values[last] - values[first])
+            * (times[first + 1:last] - times[first])
+            / (times[last] - times[first]))
+        errors = np.abs(values[first + 1:last] - interpolated)
+        farthest = np.argmax(errors)
+        if errors[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            segments.append((first, middle))
+            segments.append((middle, last))
+    return np.flatnonzero(keep)
+
+
+class DragRecorder:
+    """Offsets, rotations and sizes of images sampled at each update of a
+    gesture, in a preallocated buffer grown by doubling when full"""
+
+    PROPERTIES = ('offset_x', 'offset_y', 'rotation', 'size')
+
+    def __init__(self, capacity=1024):
+        self.times = np.empty(capacity)
+        self.values = None
+        self.indices = None
+        self.length = 0
+
+    def clear(self):
+        self.indices = None
+        self.length = 0
+
+    def record(self, time, batch, indices):
+        """Sample the values last written to the images. Samples restart
+        when the images change"""
+        if self.indices is None or not np.array_equal(indices, self.indices):
+            self.indices = indices.copy()
+            self.values = np.empty((len(self.times), len(indices),
+                                    len(self.PROPERTIES)))
+            self.length = 0
+        elif time <= self.times[self.length - 1]:
+            return
+        if self.length == len(self.times):
+            self.times = np.concatenate((self.times, np.empty_like(self.times)))
+            self.values = np.concatenate((self.values,
+                                          np.empty_like(self.values)))
+        values = self.values[self.length]
+        values[:, :2] = batch.location[indices]
+        values[:, 2] = batch.rotation[indices]
+        values[:, 3] = batch.size[indices]
+        self.times[self.length] = time
+        self.length += 1
+
+
+# Scene ID property holding recorded keys: groups by image name, holding
+# groups by view axis, with frames and values of each recorded property.
+# Image names are as long as ID property names can be, so they aren't
+# combined with axes
+ANIMATION_KEY = 'background_image_keys'
+
+
+def get_animation_key(image, view_axis):
+    return image.name, view_axis
+
+
+def get_animation_curves(animation, key, create=False):
+    """Get the curves of an animation key, or None if it has none"""
+    name, view_axis = key
+    if create:
+        return animation.setdefault(name, {}).setdefault(view_axis, {})
+    return animation.get(name, {}).get(view_axis)
+
+
+def write_recorded_keys(scene, recorder, keys, tolerances):
+    """Store recorded curves as keys in the scene, from the current frame
+    on, simplified within tolerances (an array with a row per recorded
+    image, and a column per property). keys are the animation keys of all
+    images. Keys in the recorded frame range are replaced. Return the
+    number of keys written"""
+    length = recorder.length
+    frames = scene.frame_current + (
+        (recorder.times[:length] - recorder.times[0])
+        * scene.render.fps / scene.render.fps_base)
+    animation = scene.get(ANIMATION_KEY)
+    animation = animation.to_dict() if animation is not None else {}
+
+    key_count = 0
+    for row, i in enumerate(recorder.indices.tolist()):
+        curves = get_animation_curves(animation, keys[i], create=True)
+        for column, name in enumerate(recorder.PROPERTIES):
+            values = recorder.values[:length, row, column]
+            if values.min() == values.max():
+                continue
+            kept = simplify_curve(frames, values, tolerances[row, column])
+            set_curve_keys(curves, name, frames[kept], values[kept])
+            key_count += len(kept)
+    scene[ANIMATION_KEY] = animation
+    return key_count
+
+
+def set_curve_keys(curves, name, frames, values):
+    """Set keys of a property's curve, replacing those in their frame
+    range"""
+    curve = curves.get(name, {'frames': [], 'values': []})
+    old_frames = np.array(curve['frames'], dtype=float)
+    old_values = np.array(curve['values'], dtype=float)
+    outside = (old_frames < frames[0]) | (old_frames > frames[-1])
+    new_frames = np.concatenate((old_frames[outside], frames))
+    new_values = np.concatenate((old_values[outside], values))
+    order = np.argsort(new_frames)
+    curves[name] = {'frames': new_frames[order].tolist(),
+                    'values': new_values[order].tolist()}
+
+
+@persistent
+def apply_recorded_keys(scene):
+    """Set the animated properties of background images of all 3D Views
+    to their recorded keys' values at the current frame"""
+    animation = scene.get(ANIMATION_KEY)
+    if not animation:
+        return
+    for screen in bpy.data.screens:
+        for area in screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+            for background_image in area.spaces.active.background_images:
+                if background_image.image is None:
+                    continue
+                curves = get_animation_curves(animation, get_animation_key(
+                    background_image.image, background_image.view_axis))
+                if curves is None:
+                    continue
+                for name, curve in curves.items():
+                    setattr(background_image, name, float(np.interp(
+                        scene.frame_current,
+                        list(curve['frames']), list(curve['values']))))
+
+
+# Motion estimates of sequence frames, cached next to the frame files,
+# estimated by background Blender processes importing this module
+STABILIZE_DIRECTORY = 'BL_stabilize'
+STABILIZE_SCRIPT = """
+import sys
+directory, module_name, job = sys.argv[sys.argv.index('--') + 1:]
+sys.path.insert(0, directory)
+__import__(module_name).run_stabilize_job(job)
+"""
+
+
+def get_sequence_filepath(filepath, number):
+    """Get the path of a frame of an image sequence, numbered as the last
+    number in the file name"""
+    directory, filename = os.path.split(filepath)
+    matches = list(re.finditer(r'\d+', filename))
+    if not matches:
+        return filepath
+    match = matches[-1]
+    return os.path.join(directory, '%s%0*i%s' % (
+        filename[:match.start()], len(match.group()), number,
+        filename[match.end():]))
+
+
+def load_frame_pixels(filepath, size):
+    """Load an image file, no larger than size pixels, as a grayscale
+    array (rows going up)"""
+    image = bpy.data.images.load(filepath)
+    try:
+        width, height = image.size
+        scale = size / max(width, height)
+        if scale < 1.0:
+            image.scale(max(1, round(width * scale)),
+                        max(1, round(height * scale)))
+        return get_image_pyramid(image)[0]
+    finally:
+        bpy.data.images.remove(image)
+
+
+def run_stabilize_job(filepath):
+    """Estimate the motion of frames relative to a reference frame, as
+    described by a job file, writing each estimate to its output file.
+    Run by background Blender processes"""
+    with open(filepath) as f:
+        job = json.load(f)
+    reference = load_frame_pixels(job['reference'], job['size'])
+    for frame, output in zip(job['frames'], job['outputs']):
+        try:
+            pixels = load_frame_pixels(frame, job['size'])
+        except RuntimeError:
+            continue
+        if pixels.shape != reference.shape:
+            continue
+        offset, angle = estimate_frame_motion(reference, pixels,
+                                              job['rotation'])
+        # Offsets in image widths, independent of the resolution
+        temporary_output = output + '.tmp'
+        with open(temporary_output, 'w') as f:
+            json.dump({'offset': (offset / reference.shape[1]).tolist(),
+                       'angle': angle}, f)
+        os.replace(temporary_output, output)
+
+
+def get_motion_cache_path(directory, reference, frame, size, rotation):
+    """Get the path of the cached motion estimate of a frame, named by its
+    frame and reference files, their stats and the estimate's settings"""
+    key = [size, rotation]
+    for filepath in (reference, frame):
+        stat = os.stat(filepath)
+        key += [filepath, stat.st_size, stat.st_mtime]
+    return os.path.join(directory, '%s.json' % hashlib.sha1(
+        json.dumps(key).encode()).hexdigest())
+
+
+def estimate_sequence_motion(reference, frames, size=256, rotation=False,
+                             binary_path=None):
+    """Get the motion of frames of an image sequence relative to a
+    reference frame, by file path: offsets in image widths and clockwise
+    angles, or None for frames which couldn't be estimated.
+
+    Estimates are cached next to the frames. Missing ones are estimated
+    by background Blender processes, in parallel.
+    """
+    directory = os.path.join(os.path.dirname(reference), STABILIZE_DIRECTORY)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        # Only cached for this call
+        directory = tempfile.mkdtemp()
+
+    outputs = []
+    for frame in frames:
+        try:
+            outputs.append(get_motion_cache_path(directory, reference, frame,
+                                                 size, rotation))
+        except OSError:
+            outputs.append(None)
+    missing = [i for i, output in enumerate(outputs)
+               if output is not None and not os.path.exists(output)]
+
+    def run_job(indices):
+        handle, job_filepath = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'reference': reference, 'size': size,
+                       'rotation': rotation,
+                       'frames': [frames[i] for i in indices],
+                       'outputs': [outputs[i] for i in indices]}, f)
+        try:
+            subprocess.run(
+                [binary_path or bpy.app.binary_path, '--background',
+                 '--factory-startup', '--python-expr', STABILIZE_SCRIPT, '--',
+                 os.path.dirname(os.path.abspath(__file__)), __name__,
+                 job_filepath],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        finally:
+            os.remove(job_filepath)
+
+    if missing:
+        # Each process estimates a share of the frames
+        process_count = min(os.cpu_count() or 1, len(missing))
+        with ThreadPoolExecutor(max_workers=process_count) as executor:
+            list(executor.map(run_job, [
+                chunk.tolist() for chunk in
+                np.array_split(np.array(missing), process_count)]))
+
+    motion = []
+    for output in outputs:
+        try:
+            with open(output) as f:
+                estimate = json.load(f)
+            motion.append((np.array(estimate['offset']), estimate['angle']))
+        except (OSError, TypeError, ValueError):
+            motion.append(None)
+    return motion
+
+
+def stabilize_background_image(scene, background_image, rotation=False,
+                               size=256, binary_path=None):
+    """Key the offsets (and rotations) of an image sequence background
+    image at each frame of the sequence, so that its contents stay where
+    they are at the current frame. Return the number of frames keyed.
+
+    The sequence's frames are downscaled to size pixels, and their motion
+    estimated with phase correlation. Keys are stored and applied as
+    recorded keys are, in an ortho view's conventions.
+    """
+    image = background_image.image
+    if image is None or image.source != 'SEQUENCE':
+        raise ValueError('Not an image sequence')
+    image_user = background_image.image_user
+    scene_frames = np.arange(image_user.frame_start,
+                             image_user.frame_start
+                             + image_user.frame_duration)
+    if not len(scene_frames):
+        return 0
+    filepath = bpy.path.abspath(image.filepath, library=image.library)
+    filepaths = [get_sequence_filepath(filepath, number) for number in
+                 (scene_frames - image_user.frame_start + 1
+                  + image_user.frame_offset).tolist()]
+    reference_frame = int(np.clip(scene.frame_current, scene_frames[0],
+                                  scene_frames[-1]))
+    motion = estimate_sequence_motion(
+        filepaths[reference_frame - scene_frames[0]], filepaths, size,
+        rotation, binary_path)
+
+    # Transform the image at each frame by the inverse of its contents'
+    # motion, turned by the image's own rotation and flips
+    batch = BackgroundImageBatch([background_image])
+    indices = np.array((0,))
+    center = batch.initial_location_view[0]
+    image_rotation = batch.initial_rotation[0]
+    flip_signs = np.where(batch.initial_flip[0], -1.0, 1.0)
+    cos_r, sin_r = np.cos(image_rotation), np.sin(image_rotation)
+    frames = []
+    values = []
+    for frame, estimate in zip(scene_frames.tolist(), motion):
+        if estimate is None:
+            continue
+        offset, angle = estimate
+        local = offset * 2.0 * batch.initial_size[0] * flip_signs
+        view_offset = -np.array((local[0] * cos_r + local[1] * sin_r,
+                                 -local[0] * sin_r + local[1] * cos_r))
+        locations, rotations, _sizes = batch.similarity(
+            indices, center, -angle * flip_signs.prod(), 1.0, view_offset)
+        frames.append(frame)
+        values.append((locations[0, 0], locations[0, 1], rotations[0]))
+    if not frames:
+        return 0
+
+    animation = scene.get(ANIMATION_KEY)
+    animation = animation.to_dict() if animation is not None else {}
+    curves = get_animation_curves(
+        animation, get_animation_key(image, background_image.view_axis),
+        create=True)
+    frames = np.array(frames, dtype=float)
+    values = np.array(values)
+    names = ('offset_x', 'offset_y', 'rotation') if rotation else (
+        'offset_x', 'offset_y')
+    for column, name in enumerate(names):
+        set_curve_keys(curves, name, frames, values[:, column])
+    scene[ANIMATION_KEY] = animation
+    return len(frames)
+
+
+# Scene ID property holding layouts of background images by 3D View: for
+# each view, a base layout, and layouts by name, storing only the images
+# which differ from the base
+LAYOUTS_KEY = 'background_image_layouts'
+
+
+def get_layout_values(background_images):
+    """Get offsets, rotation and size of background images as an array
+    with a row per image, and their flips as bit masks"""
+    values = np.array([(bgi.offset_x, bgi.offset_y, bgi.rotation, bgi.size)
+                       for bgi in background_images],
+                      dtype=float).reshape(-1, 4)
+    flips = np.array([bgi.use_flip_x | bgi.use_flip_y << 1
+                      for bgi in background_images], dtype=int)
+    return values, flips
+
+
+def encode_layout(values, flips, indices, relative):
+    record = {'count': len(flips), 'relative': relative}
+    # Empty arrays are left out
+    if len(indices):
+        record['indices'] = indices.tolist()
+        record['values'] = values[indices].ravel().tolist()
+        record['flips'] = flips[indices].tolist()
+    return record
+
+
+def decode_layout(record, base=None):
+    count = record['count']
+    if record['relative']:
+        values, flips = decode_layout(base)
+        values = values[:count]
+        flips = flips[:count]
+    else:
+        values = np.zeros((count, 4))
+        flips = np.zeros(count, dtype=int)
+    if 'indices' in record:
+        indices = np.array(record['indices'], dtype=int)
+        values[indices] = np.reshape(record['values'], (-1, 4))
+        flips[indices] = record['flips']
+    return values, flips
+
+
+def get_view_key(context):
+    """Get a name of the context's 3D View which layouts are stored under:
+    its screen's name and the index of its area in the screen"""
+    return '%s/%i' % (context.screen.name,
+                      context.screen.areas[:].index(context.area))
+
+
+def get_layouts(scene, view):
+    """Get the base layout and layouts stored for a view"""
+    layouts = scene.get(LAYOUTS_KEY, {}).get(view)
+    return layouts.to_dict() if layouts is not None else {'layouts': {}}
+
+
+def set_layouts(scene, view, layouts):
+    """Store the layouts of a view, removing it when it has none"""
+    views = scene[LAYOUTS_KEY].to_dict() if LAYOUTS_KEY in scene else {}
+    if layouts['layouts']:
+        views[view] = layouts
+    else:
+        views.pop(view, None)
+    if views:
+        scene[LAYOUTS_KEY] = views
+    elif LAYOUTS_KEY in scene:
+        del scene[LAYOUTS_KEY]
+
+
+def save_layout(scene, view, name, background_images):
+    """Store the layout of a view's background images in the scene, as the
+    differences from the view's base layout. The first layout saved in a
+    view is its base layout"""
+    layouts = get_layouts(scene, view)
+    values, flips = get_layout_values(background_images)
+    base = layouts.get('base')
+    if base is None:
+        base = layouts['base'] = encode_layout(
+            values, flips, np.arange(len(flips)), False)
+
+    if base['count'] >= len(flips):
+        base_values, base_flips = decode_layout(base)
+        count = len(flips)
+        changed = np.flatnonzero(
+            (values != base_values[:count]).any(axis=1)
+            | (flips != base_flips[:count]))
+        layouts['layouts'][name] = encode_layout(values, flips, changed, True)
+    else:
+        layouts['layouts'][name] = encode_layout(
+            values, flips, np.arange(len(flips)), False)
+    set_layouts(scene, view, layouts)
+
+
+def restore_layout(scene, view, name, background_images):
+    """Set a view's background images to one of its layouts, only writing
+    the properties which differ. Images are matched by position. Return
+    the number of properties written. Raise KeyError if the view has no
+    such layout"""
+    layouts = get_layouts(scene, view)
+    values, flips = decode_layout(layouts['layouts'][name], layouts['base'])
+    count = min(len(flips), len(background_images))
+    # Values are written as they are, so image dimensions aren't needed,
+    # and slots without images are restored too
+    batch = BackgroundImageBatch(list(background_images)[:count],
+                                 dimensions=[(1.0, 1.0)] * count)
+    indices = np.arange(count)
+    return (batch.write_locations(indices, values[:count, :2])
+            + batch.write_rotations(indices, values[:count, 2])
+            + batch.write_sizes(indices, values[:count, 3])
+            + batch.write_flips(indices, np.column_stack(
+                (flips[:count] & 1, flips[:count] & 2)).astype(bool)))
+
+
+def delete_layout(scene, view, name):
+    """Remove a layout of a view from the scene, and the view's base layout
+    with its last one"""
+    layouts = get_layouts(scene, view)
+    del layouts['layouts'][name]
+    set_layouts(scene, view, layouts)
+
+
+class TransformSession:
+    """Values which stay the same during a transform gesture.
+
+    The session must be rebuilt when the mode, pivot mode, active image
+    or transformed images change.
+    """
+    __slots__ = ('pivot_mode', 'indices', 'pivot_point', 'pivot_array',
+                 'pivot_point_region', 'initial_mouse_vector',
+                 'initial_mouse_distance', 'polar', 'moving',
+                 'snap_tree', 'snap_points')
+
+    def __init__(self, operator, context):
+        batch = operator.batch
+        self.pivot_mode = context.space_data.pivot_point
+        self.indices = operator.get_image_indices()
+        self.pivot_point = operator.get_pivot_point(context, self.indices)
+        self.pivot_array = np.array(self.pivot_point)
+        self.pivot_point_region = Vector(
+            operator.projection.view_to_region(self.pivot_array))
+
+        self.initial_mouse_vector = None
+        self.initial_mouse_distance = None
+        self.polar = None
+        self.moving = None
+        self.snap_tree = None
+        self.snap_points = None
+        if operator.mode == 'NONE':
+            return
+
+        self.initial_mouse_vector = (
+            operator.initial_mouse_location_2d - self.pivot_point)
+        self.initial_mouse_distance = self.initial_mouse_vector.length
+
+        if (operator.mode == 'ROTATE'
+                and self.pivot_mode != 'INDIVIDUAL_ORIGINS'):
+            self.polar = batch.polar_coordinates(
+                self.indices, self.pivot_array)
+
+        elif operator.mode == 'SCALE':
+            # Images translated along a line
+            # between the pivot and original location
+            if self.pivot_mode in ('CURSOR',
+                                   'BOUNDING_BOX_CENTER',
+                                   'MEDIAN_POINT'):
+                self.moving = np.ones(len(self.indices), dtype=bool)
+            elif self.pivot_mode == 'ACTIVE_ELEMENT':
+                self.moving = self.indices != operator.active_image
+            else:
+                self.moving = np.zeros(len(self.indices), dtype=bool)
+
+    def init_snapping(self, batch, active_image):
+        """Build a KD-tree of the snap points of the images which are not
+        transformed, and get the active image's snap points"""
+        rectangles = batch.initial_rectangles()
+        targets = np.setdiff1d(np.arange(len(batch)), self.indices)
+        target_points = batch.snap_points(
+            *(array[targets] for array in rectangles)).reshape(-1, 2)
+        self.snap_tree = kdtree.KDTree(len(target_points))
+        for i, (x, y) in enumerate(target_points.tolist()):
+            self.snap_tree.insert((x, y, 0.0), i)
+        self.snap_tree.balance()
+
+        self.snap_points = batch.snap_points(
+            *(array[[active_image]] for array in rectangles))[0]
+
+
+class EventState:
+    """Copy of the event attributes used to update transforms,
+    since events can't be kept around between modal calls"""
+    __slots__ = ('mouse_region_x', 'mouse_region_y', 'ctrl', 'shift')
+
+    def __init__(self, event):
+        self.mouse_region_x = event.mouse_region_x
+        self.mouse_region_y = event.mouse_region_y
+        self.ctrl = event.ctrl
+        self.shift = event.shift
+
+    def __eq__(self, other):
+        return (isinstance(other, EventState)
+                and self.mouse_region_x == other.mouse_region_x
+                and self.mouse_region_y == other.mouse_region_y
+                and self.ctrl == other.ctrl
+                and self.shift == other.shift)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Profiler:
+    """Durations and counts of the transform operator's phases, keeping
+    the last records in a ring buffer. Phases can be nested: reset
+    includes the property writes restoring images, for instance"""
+
+    PHASES = ('event', 'init_images', 'reset', 'pivot', 'math',
+              'rna_writes', 'header', 'redraw')
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.phases = np.zeros(capacity, dtype=np.uint8)
+        self.starts = np.zeros(capacity)
+        self.durations = np.zeros(capacity)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        self.position = 0
+        self.length = 0
+
+    def record(self, phase, start, duration, count=1):
+        i = self.position
+        self.phases[i] = self.PHASES.index(phase)
+        self.starts[i] = start
+        self.durations[i] = duration
+        self.counts[i] = count
+        self.position = (i + 1) % self.capacity
+        self.length = min(self.length + 1, self.capacity)
+
+    def wrap(self, phase, function, get_count=None):
+        """Get a function recording the durations of function calls,
+        and the counts returned by get_count from their results"""
+        def wrapped(*args, **kwargs):
+            start = perf_counter()
+            result = function(*args, **kwargs)
+            self.record(phase, start, perf_counter() - start,
+                        1 if get_count is None else get_count(result))
+            return result
+        return wrapped
+
+    def get_records(self):
+        """Get records, oldest first, as arrays of phase indices, start
+        times, durations and counts"""
+        order = (self.position - self.length
+                 + np.arange(self.length)) % self.capacity
+        return (self.phases[order], self.starts[order],
+                self.durations[order], self.counts[order])
+
+    def get_summary(self):
+        """Get the number of calls, total count, mean and maximum
+        duration in milliseconds of recorded phases"""
+        phases, _starts, durations, counts = self.get_records()
+        summary = {}
+        for i, phase in enumerate(self.PHASES):
+            recorded = phases == i
+            if recorded.any():
+                summary[phase] = {
+                    'calls': int(recorded.sum()),
+                    'count': int(counts[recorded].sum()),
+                    'mean_ms': float(durations[recorded].mean() * 1000.0),
+                    'max_ms': float(durations[recorded].max() * 1000.0)}
+        return summary
+
+    def export(self, filepath):
+        """Write the summary and records to a JSON file"""
+        phases, starts, durations, counts = self.get_records()
+        records = [{'phase': self.PHASES[phase],
+                    'start': start,
+                    'duration_ms': duration * 1000.0,
+                    'count': count}
+                   for phase, start, duration, count in zip(
+                       phases.tolist(), starts.tolist(),
+                       durations.tolist(), counts.tolist())]
+        with open(filepath, 'w') as f:
+            json.dump({'summary': self.get_summary(), 'records': records},
+                      f, indent=1)
+
+
+# Records of all operator runs, when profiling is enabled
+profiler = Profiler()
+
+
+class BglBackend:
+    """Overlay drawing with bgl, keeping batches in display lists"""
+
+    def create_batch(self, primitive, vertices):
+        """Store vertices (array of shape (n, 2)) drawn as a primitive
+        ('LINES', 'LINE_STRIP' or 'LINE_LOOP'), and return a handle"""
+        handle = bgl.glGenLists(1)
+        bgl.glNewList(handle, bgl.GL_COMPILE)
+        bgl.glBegin(getattr(bgl, 'GL_' + primitive))
+        for x, y in vertices.tolist():
+            bgl.glVertex2f(x, y)
         bgl.glEnd()
+        bgl.glEndList()
+        return handle
+
+    def delete_batch(self, handle):
+        bgl.glDeleteLists(handle, 1)
+
+    def draw_batch(self, handle, color, matrix=None, width=1.0,
+                   stipple=False):
+        """Draw a batch, transformed by a 2x3 affine matrix"""
+        bgl.glEnable(bgl.GL_BLEND)
+        if stipple:
+            bgl.glEnable(bgl.GL_LINE_STIPPLE)
+        bgl.glColor4f(*color)
+        bgl.glLineWidth(width)
+        if matrix is not None:
+            self.push_matrix(matrix)
+        bgl.glCallList(handle)
+        if matrix is not None:
+            bgl.glPopMatrix()
 
         # restore opengl defaults
         bgl.glLineWidth(1)
@@ -132,6 +2421,191 @@ def draw_callback_px(self, context):
         bgl.glDisable(bgl.GL_LINE_STIPPLE)
         bgl.glColor4f(0.0, 0.0, 0.0, 1.0)
 
+    @staticmethod
+    def push_matrix(matrix):
+        """Push the modelview matrix, multiplied by a 2x3 affine matrix"""
+        bgl.glPushMatrix()
+        bgl.glMultMatrixf(bgl.Buffer(bgl.GL_FLOAT, 16, [
+            matrix[0, 0], matrix[1, 0], 0.0, 0.0,
+            matrix[0, 1], matrix[1, 1], 0.0, 0.0,
+            0.0, 0.0, 1.0, 0.0,
+            matrix[0, 2], matrix[1, 2], 0.0, 1.0]))
+
+    def create_texture(self, image):
+        """Load an image as a texture, and return a handle, or None if
+        it can't be loaded"""
+        # Textures Blender already has are left to it
+        owned = not image.bindcode[0]
+        if owned and image.gl_load(filter=bgl.GL_LINEAR, mag=bgl.GL_LINEAR):
+            return None
+        return image, owned
+
+    def delete_texture(self, handle):
+        image, owned = handle
+        if owned:
+            image.gl_free()
+
+    def draw_texture(self, handle, vertices, uvs, opacity=1.0, matrix=None):
+        """Draw a texture on a quad, given its vertices and texture
+        coordinates (arrays of shape (4, 2)), transformed by a 2x3 affine
+        matrix"""
+        image, _owned = handle
+        bgl.glEnable(bgl.GL_BLEND)
+        bgl.glEnable(bgl.GL_TEXTURE_2D)
+        bgl.glBindTexture(bgl.GL_TEXTURE_2D, image.bindcode[0])
+        bgl.glColor4f(1.0, 1.0, 1.0, opacity)
+        if matrix is not None:
+            self.push_matrix(matrix)
+        bgl.glBegin(bgl.GL_QUADS)
+        for (u, v), (x, y) in zip(uvs.tolist(), vertices.tolist()):
+            bgl.glTexCoord2f(u, v)
+            bgl.glVertex2f(x, y)
+        bgl.glEnd()
+        if matrix is not None:
+            bgl.glPopMatrix()
+
+        # restore opengl defaults
+        bgl.glBindTexture(bgl.GL_TEXTURE_2D, 0)
+        bgl.glDisable(bgl.GL_TEXTURE_2D)
+        bgl.glDisable(bgl.GL_BLEND)
+        bgl.glColor4f(0.0, 0.0, 0.0, 1.0)
+
+
+class Overlay:
+    """Outlines of the images, highlight of the active image, pivot line
+    and snap target square.
+
+    Vertex batches are built by a drawing backend, and only rebuilt when
+    their geometry changes: outlines are kept in view space and drawn
+    through the view to region mapping, and are rebuilt only when their
+    images are written to.
+
+    When previewing, images are also drawn as textured quads, with
+    textures loaded once per image.
+    """
+
+    # Texture coordinates of the corners of images, as given by
+    # BackgroundImageBatch.corners()
+    UVS = np.array(((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)))
+
+    def __init__(self, backend):
+        self.backend = backend
+        # Batch handles and the geometry keys they were built for, by name
+        self.batches = {}
+        # Texture handles, by image name
+        self.textures = {}
+
+    def get_batch(self, name, key, primitive, get_vertices):
+        cached = self.batches.get(name)
+        if cached is not None:
+            if cached[0] == key:
+                return cached[1]
+            if cached[1] is not None:
+                self.backend.delete_batch(cached[1])
+        vertices = get_vertices()
+        handle = (self.backend.create_batch(primitive, vertices)
+                  if len(vertices) else None)
+        self.batches[name] = (key, handle)
+        return handle
+
+    def get_outlines(self, name, batch, indices):
+        def get_vertices():
+            corners = batch.corners(*batch.rectangles(indices))
+            return np.stack((corners, np.roll(corners, -1, axis=1)),
+                            axis=2).reshape(-1, 2)
+        key = (indices.tobytes(), int(batch.revisions[indices].sum()))
+        return self.get_batch(name, key, 'LINES', get_vertices)
+
+    def draw_outlines(self, batch, moving, active_image, matrix):
+        static = np.setdiff1d(np.arange(len(batch)), moving)
+        for name, indices, color in (
+                ('static', static, (0.0, 0.0, 0.0, 0.5)),
+                ('moving', moving, (1.0, 1.0, 1.0, 0.8)),
+                ('active', np.array((active_image,)), (1.0, 0.6, 0.0, 1.0))):
+            handle = self.get_outlines(name, batch, indices)
+            if handle is not None:
+                self.backend.draw_batch(
+                    handle, color, matrix,
+                    width=2.0 if name == 'active' else 1.0)
+
+    def get_texture(self, image):
+        if image.name not in self.textures:
+            self.textures[image.name] = self.backend.create_texture(image)
+        return self.textures[image.name]
+
+    def draw_previews(self, batch, indices, images, matrix):
+        """Draw images (by background image index) with the batch's
+        current transforms, on top of the view"""
+        corners = batch.corners(*batch.rectangles(indices))
+        for i, vertices in zip(indices.tolist(), corners):
+            handle = self.get_texture(images[i])
+            if handle is None:
+                continue
+            uvs = self.UVS.copy()
+            flip_x, flip_y = batch.flip[i]
+            if flip_x:
+                uvs[:, 0] = 1.0 - uvs[:, 0]
+            if flip_y:
+                uvs[:, 1] = 1.0 - uvs[:, 1]
+            self.backend.draw_texture(handle, vertices, uvs,
+                                      batch.images[i].opacity, matrix)
+
+    def draw(self, batch, projection, moving, active_image,
+             line=None, snap_target=None, previews=None, outlines=True):
+        """Draw the overlay in region space. moving are the indices of the
+        images being transformed, line the pivot line's endpoints and
+        snap_target the snap target's location, in region space. previews
+        are the images drawn for pending images, by index. Without
+        outlines, only the line and snap target are drawn"""
+        backend = self.backend
+        matrix = projection.view_to_region_matrix
+        if previews is not None:
+            self.draw_previews(batch, batch.get_pending(), previews, matrix)
+        if outlines:
+            self.draw_outlines(batch, moving, active_image, matrix)
+
+        if line is not None:
+            line = tuple((int(x), int(y)) for x, y in line)
+            handle = self.get_batch('line', line, 'LINE_STRIP',
+                                    lambda: np.array(line, dtype=float))
+            backend.draw_batch(handle, (0.0, 0.0, 0.0, 1.0), stipple=True)
+
+        if snap_target is not None:
+            x, y = int(snap_target[0]), int(snap_target[1])
+            handle = self.get_batch(
+                'snap_target', (x, y), 'LINE_LOOP',
+                lambda: np.array(((x - 5, y - 5), (x + 5, y - 5),
+                                  (x + 5, y + 5), (x - 5, y + 5)),
+                                 dtype=float))
+            backend.draw_batch(handle, (1.0, 0.5, 0.0, 1.0))
+
+    def clear(self):
+        """Delete all batches and textures"""
+        for _key, handle in self.batches.values():
+            if handle is not None:
+                self.backend.delete_batch(handle)
+        self.batches.clear()
+        for handle in self.textures.values():
+            if handle is not None:
+                self.backend.delete_texture(handle)
+        self.textures.clear()
+
+
+def draw_callback_px(self, context):
+    """Draw the operator's overlay"""
+    session = self.session
+    if session is not None and self.mode != 'NONE':
+        moving = session.indices
+    else:
+        moving = np.empty(0, dtype=int)
+    self.overlay.draw(
+        self.batch, self.projection, moving, self.active_image,
+        line=(self.draw_start, self.draw_end) if self.do_draw else None,
+        snap_target=self.snap_target_region,
+        previews=self.preview_images if self.preview else None,
+        # Image extents depend on the camera frame in camera view
+        outlines=self.view_perspective != 'CAMERA')
+
 
 class BackgroundImageTransform(bpy.types.Operator):
     """Transform background image.
@@ -141,6 +2615,8 @@ Mousewheel to select image"""
     bl_label = "Transform Background Image"
     bl_options = {'REGISTER', 'UNDO', 'GRAB_CURSOR', 'BLOCKING'}
 
+    overlay_backend = BglBackend
+
     @classmethod
     def poll(self, context):
         return (context.space_data.type == 'VIEW_3D'
@@ -148,61 +2624,30 @@ Mousewheel to select image"""
 
     def reset(self):
         """Set background images' data to stored values"""
-        for i_d in self.background_images:
-            image = i_d['image']
-            image.offset_x, image.offset_y = i_d['initial_location']
-            image.rotation = i_d['initial_rotation']
-            image.size = i_d['initial_size']
+        self.batch.restore()
+        self.recorder.clear()
 
-            image.use_flip_x = i_d['initial_flip_x']
-            image.use_flip_y = i_d['initial_flip_y']
+    def get_image_indices(self):
+        """Get indices of the images to transform"""
+        if self.transform_all:
+            return np.arange(len(self.batch))
+        return np.array((self.active_image,))
 
-    def get_pivot_point(self, context, images):
+    def get_pivot_point(self, context, indices):
         """ Get pivot type from space properties"""
         if context.space_data.pivot_point == 'CURSOR':
-            pivot_point = (
-                space_to_view_vector(
-                    self.camera_orientation,
-                    context.space_data.cursor_location))
+            pivot_point = Vector(self.projection.world_to_view(
+                context.space_data.cursor_location))
         elif context.space_data.pivot_point in ('BOUNDING_BOX_CENTER',
                                                 'MEDIAN_POINT',
                                                 'INDIVIDUAL_ORIGINS'):
-            pivot_point = Vector((0.0, 0.0))
-            for i_d in images:
-                pivot_point += i_d['initial_location_view']
-            pivot_point /= len(images)
+            pivot_point = Vector(self.batch.median_point(indices))
         elif context.space_data.pivot_point == 'ACTIVE_ELEMENT':
-            pivot_point = self.background_images[self.active_image]['initial_location_view'].copy()
+            pivot_point = Vector(
+                self.batch.initial_location_view[self.active_image])
         return pivot_point
 
-    def update(self, context, event):
-        """Update transforms on each call"""
-        region = context.region
-        rv3d = context.region_data
-
-        mouse_location_3d = (
-            view3d_utils.region_2d_to_location_3d(
-                region,
-                rv3d,
-                (event.mouse_region_x, event.mouse_region_y),
-                Vector()))
-
-        if self.transform_all:
-            images = self.background_images
-        else:
-            images = (self.background_images[self.active_image],)
-
-        pivot_point = self.get_pivot_point(context, images)
-
-        try:
-            numeric_input = eval(self.numeric_input_string)
-            if self.numeric_input_opposite:
-                numeric_input = -numeric_input
-            if self.numeric_input_divide:
-                numeric_input = 1.0 / numeric_input
-        except:
-            numeric_input = None
-
+    def get_help_string(self):
         help_string  = 'Confirm: (Enter/LMB), '
         help_string += 'Cancel: (Esc/RMB), '
         help_string += 'Choose Image: (Mousewheel), '
@@ -212,189 +2657,491 @@ Mousewheel to select image"""
         if self.view_perspective == 'ORTHO':
             help_string += ', Scale: (S)'
         help_string += ', Constrain to axis: (X/Y)'
+        help_string += ', Snap to Images: (I)'
+        help_string += ', Sync Views: (V)'
+        help_string += ', Record Keys: (K)'
+        help_string += ', Nudge: (Arrows/[/]/+/-), Undo Nudge: (Ctrl Z)'
+        if self.view_perspective == 'ORTHO':
+            help_string += ', Align to Image under Mouse: (L)'
+        return help_string
+
+    def get_snap_points(self):
+        """Get the active image's snap points, building the snap targets
+        on first use in the gesture"""
+        session = self.session
+        if session.snap_tree is None:
+            session.init_snapping(self.batch, self.active_image)
+        return session.snap_points
+
+    def find_snap_target(self, points):
+        """Find the closest snap point of the other images to any of the
+        given points, if close enough.
+        Return the index of the snapped point and the target, or None"""
+        closest = None
+        for row, (x, y) in enumerate(points.tolist()):
+            co, _index, distance = self.session.snap_tree.find((x, y, 0.0))
+            if co is not None and (closest is None or distance < closest[2]):
+                closest = row, co, distance
+        if (closest is None
+                or closest[2] > SNAP_DISTANCE * self.projection.pixel_size):
+            return None
+
+        self.snap_target = np.array(closest[1][:2])
+        return closest[0], self.snap_target
+
+    def snap_translation(self, offset):
+        """Snap the active image's corners, edge midpoints or center
+        to those of other images"""
+        snap_points = self.get_snap_points()
+        found = self.find_snap_target(snap_points + np.array(offset))
+        if found is not None:
+            row, target = found
+            offset = Vector(target - snap_points[row])
+        return offset
+
+    def snap_scale(self, scale_offset):
+        """Snap the scaled active image's corners, edge midpoints or center
+        to those of other images"""
+        session = self.session
+        center = self.batch.initial_location_view[self.active_image]
+        local = self.get_snap_points() - center
+
+        # Snap points move along lines: origin + direction * scale
+        row = np.flatnonzero(session.indices == self.active_image)[0]
+        if session.moving[row]:
+            origin = session.pivot_array
+            direction = center - origin + local
+        else:
+            origin = center
+            direction = local
+        lengths_squared = (direction ** 2).sum(axis=1)
+        can_snap = np.flatnonzero(lengths_squared > 0.0)
+
+        found = self.find_snap_target(
+            origin + direction[can_snap] * scale_offset)
+        if found is not None:
+            row, target = found
+            row = can_snap[row]
+            scale_offset = max(0.0, float(
+                (target - origin) @ direction[row] / lengths_squared[row]))
+        return scale_offset
+
+    def update(self, context, event):
+        """Update transforms on each call"""
+        if not self.projection.is_valid(context):
+            self.projection = ViewProjection(context, self.camera_orientation)
+            self.session = None
+        if (self.session is None
+                or self.session.pivot_mode != context.space_data.pivot_point):
+            self.session = TransformSession(self, context)
+            self.show_proxies(
+                self.session.indices.tolist() if self.mode != 'NONE' else ())
+        session = self.session
+        indices = session.indices
+        pivot_point = session.pivot_point
+        help_string = self.help_string
+
+        mouse_location_2d = Vector(self.projection.region_to_view(
+            (event.mouse_region_x, event.mouse_region_y)))
+
+        numeric_input = self.numeric_input
+        if numeric_input:
+            help_string = 'Input: %s, %s' % (numeric_input, help_string)
+        if self.snap_to_images:
+            help_string = 'Snapping to Images, ' + help_string
+        if self.sync_views:
+            help_string = 'Syncing Views, ' + help_string
+        if self.recording:
+            help_string = 'Recording, ' + help_string
+        if self.nudge_history:
+            help_string = 'Nudges: %i, ' % len(self.nudge_history) + help_string
+        self.snap_target = None
 
         if self.mode != 'NONE':
-            for i_i, i_d in enumerate(images):
-                pivot_point_image = pivot_point.copy()
-                pivot_point_image.y *= i_d['width'] / i_d['height']
-
-                initial_mouse_vector = self.initial_mouse_location_2d - pivot_point
-                current_mouse_vector = space_to_view_vector(
-                    self.camera_orientation,
-                    mouse_location_3d) - pivot_point
-
-                if self.mode == 'TRANSLATE':
-
-                    if self.numeric_input_string and numeric_input is not None:
-                        offset = Vector((numeric_input, numeric_input))
-                        print(offset)
-                    else:
-                        # Get mouse differential in view space
-                        offset = space_to_view_vector(
-                            self.camera_orientation,
-                            (mouse_location_3d - self.initial_mouse_location_3d))
-
-                        # Snap mode
-                        if event.ctrl:
-                            offset.x //= 1
-                            offset.y //= 1
-
-                        # Precision mode
-                        if event.shift:
-                            offset *= 0.1
-
-                    # Offset is based a factor of width or height
-                    offset.y *= i_d['width'] / i_d['height']
-
-                    # Axis constraint
-                    if self.constrain_x:
-                        offset.y = 0.0
-                    if self.constrain_y:
-                        offset.x = 0.0
-
-                    # Apply translation to background image
-                    i_d['image'].offset_x, i_d['image'].offset_y = (
-                        i_d['initial_location'] + offset)
-                    context.area.header_text_set(
-                        "Dx: %.4f Dy: %.4f, " % tuple(offset) + help_string)
-
-                elif self.mode == 'ROTATE':
-                    if self.numeric_input_string and numeric_input is not None:
-                        rotation_offset = radians(numeric_input)
-                    else:
-                        # Get angles in view space
-                        rotation_offset = initial_mouse_vector.angle_signed(
-                            current_mouse_vector)
-
-                        # Add whole turns to avoid precision mode popping
-                        if (self.previous_rotation_offset < 0
-                                and rotation_offset > 0
-                                and abs(rotation_offset) > pi/2):
-                            self.revolutions -= 1
-                        elif (self.previous_rotation_offset > 0
-                                and rotation_offset < 0
-                                and abs(rotation_offset) > pi/2):
-                            self.revolutions += 1
-
-                        self.previous_rotation_offset = rotation_offset
-                        rotation_offset += self.revolutions * 2*pi
-
-                        # Snap mode
-                        if event.ctrl:
-                            rotation_offset = (
-                                radians((degrees(rotation_offset) // 5) * 5))
-                        # Precision mode
-                        if event.shift:
-                            rotation_offset *= 0.1
-
-                    # Translate image in a circular path around 3D cursor
-                    if ((context.space_data.pivot_point in (
-                            'CURSOR', 'BOUNDING_BOX_CENTER',
-                            'MEDIAN_POINT', 'ACTIVE_ELEMENT')
-                            or (context.space_data.pivot_point == 'ACTIVE_ELEMENT'
-                                and i_i != self.active_image))
-                            and (i_d['initial_location_view']
-                                 - pivot_point).length_squared != 0):
-                        initial_angle = (
-                            i_d['initial_location_view']
-                            - pivot_point).angle_signed(Vector((1.0, 0.0)))
-                        rotation_distance = (
-                            i_d['initial_location_view']
-                            - pivot_point).length
-                        offset = pivot_point_image
-                        offset.x += (
-                            cos(initial_angle - rotation_offset)
-                            * rotation_distance)
-                        offset.y += (
-                            sin(initial_angle - rotation_offset)
-                            * rotation_distance
-                            * i_d['width']
-                            / i_d['height'])
-                        i_d['image'].offset_x, i_d['image'].offset_y = offset
-
-                    # Apply rotation to background image
-                    i_d['image'].rotation = (
-                        i_d['initial_rotation'] + rotation_offset)
-                    context.area.header_text_set(
-                        "Rot: %.2f°, " % degrees(rotation_offset) + help_string)
-
-                elif self.mode == 'SCALE':
-                    if self.numeric_input_string and numeric_input is not None:
-                        scale_offset = abs(numeric_input)
-                    else:
-                        scale_offset = ((
-                            space_to_view_vector(
-                                self.camera_orientation, mouse_location_3d)
-                            - pivot_point).length
-                            / (self.initial_mouse_location_2d - pivot_point).length)
-
-                        # Snap mode
-                        if event.ctrl:
-                            scale_offset = ((scale_offset * 10) // 1) / 10
-                        # Precision mode
-                        if event.shift:
-                            scale_offset = scale_offset * 0.5 + 0.5
-
-                        # Detect flip (mouse has crossed line perpendicular
-                        # to the pivot-initial mouse line)
-                        mouse_cross_product = (
-                            initial_mouse_vector * current_mouse_vector)
-                        # Cross products have the different signs
-                        # From https://stackoverflow.com/a/1986776/4561348
-                        if (copysign(1, mouse_cross_product)
-                                != copysign(1, self.previous_mouse_cp)):
-                            i_d['image'].use_flip_x = not i_d['image'].use_flip_x
-                            i_d['image'].use_flip_y = not i_d['image'].use_flip_y
-                            self.previous_mouse_cp = mouse_cross_product
-
-                        flip = -1.0 if mouse_cross_product < 0 else 1.0
-
-                        # Translate image along a line
-                        # between 3D cursor and original location
-                        if (context.space_data.pivot_point in ('CURSOR',
-                                                               'BOUNDING_BOX_CENTER',
-                                                               'MEDIAN_POINT')
-                                or (context.space_data.pivot_point == 'ACTIVE_ELEMENT'
-                                    and i_i != self.active_image)):
-                            offset = (
-                                i_d['initial_location_view']
-                                + (pivot_point - i_d['initial_location_view'])
-                                * (1-scale_offset * flip))
-                            offset.y *= i_d['width'] / i_d['height']
-                            i_d['image'].offset_x, i_d['image'].offset_y = offset
-
-                    # Apply scale to background image
-                    i_d['image'].size = i_d['initial_size'] * scale_offset
-                    context.area.header_text_set(
-                        "Scale: %.4f, " % scale_offset + help_string)
+            batch = self.batch
+            initial_mouse_vector = session.initial_mouse_vector
+            current_mouse_vector = mouse_location_2d - pivot_point
+
+            if self.mode == 'TRANSLATE':
+
+                if numeric_input and numeric_input.vector is not None:
+                    offset = Vector(numeric_input.vector)
+                else:
+                    # Get mouse differential in view space
+                    offset = mouse_location_2d - self.initial_mouse_location_2d
+
+                    # Snap mode
+                    if event.ctrl and not self.snap_to_images:
+                        offset.x //= 1
+                        offset.y //= 1
+
+                    # Precision mode
+                    if event.shift:
+                        offset *= 0.1
+
+                    if event.ctrl and self.snap_to_images:
+                        offset = self.snap_translation(offset)
+
+                # Apply translation to background images
+                locations = batch.translate(
+                    indices, offset, self.constrain_x, self.constrain_y)
+                batch.write_locations(indices, locations)
+
+                # Report the offset of the last image, as a factor
+                # of its width or height
+                offset = locations[-1] - batch.initial_location[indices[-1]]
+                self.set_header(
+                    context, "Dx: %.4f Dy: %.4f, " % tuple(offset) + help_string)
+
+            elif self.mode == 'ROTATE':
+                if numeric_input and numeric_input.value is not None:
+                    rotation_offset = radians(numeric_input.value)
+                else:
+                    # Get angles in view space
+                    rotation_offset = initial_mouse_vector.angle_signed(
+                        current_mouse_vector)
+
+                    # Add whole turns to avoid precision mode popping
+                    if (self.previous_rotation_offset < 0
+                            and rotation_offset > 0
+                            and abs(rotation_offset) > pi/2):
+                        self.revolutions -= 1
+                    elif (self.previous_rotation_offset > 0
+                            and rotation_offset < 0
+                            and abs(rotation_offset) > pi/2):
+                        self.revolutions += 1
+
+                    self.previous_rotation_offset = rotation_offset
+                    rotation_offset += self.revolutions * 2*pi
+
+                    # Snap mode
+                    if event.ctrl:
+                        rotation_offset = (
+                            radians((degrees(rotation_offset) // 5) * 5))
+                    # Precision mode
+                    if event.shift:
+                        rotation_offset *= 0.1
+
+                # Translate images in a circular path around the pivot
+                locations, rotations = batch.rotate(
+                    indices, session.pivot_array, rotation_offset,
+                    session.polar)
+                batch.write_locations(indices, locations)
+
+                # Apply rotation to background images
+                batch.write_rotations(indices, rotations)
+                self.set_header(
+                    context, "Rot: %.2f°, " % degrees(rotation_offset) + help_string)
+
+            elif self.mode == 'SCALE':
+                flip = False
+                moving = None
+                if numeric_input and numeric_input.value is not None:
+                    scale_offset = abs(numeric_input.value)
+                else:
+                    scale_offset = (current_mouse_vector.length
+                                    / session.initial_mouse_distance)
+
+                    # Snap mode
+                    if event.ctrl and not self.snap_to_images:
+                        scale_offset = ((scale_offset * 10) // 1) / 10
+                    # Precision mode
+                    if event.shift:
+                        scale_offset = scale_offset * 0.5 + 0.5
+
+                    # Detect flip (mouse has crossed line perpendicular
+                    # to the pivot-initial mouse line)
+                    flip = initial_mouse_vector.dot(current_mouse_vector) < 0
+                    moving = session.moving
+
+                    if event.ctrl and self.snap_to_images and not flip:
+                        scale_offset = self.snap_scale(scale_offset)
+
+                locations, sizes, flips = batch.scale(
+                    indices, session.pivot_array, scale_offset, flip, moving)
+                batch.write_locations(indices, locations)
+
+                # Apply scale and flip to background images
+                batch.write_sizes(indices, sizes)
+                batch.write_flips(indices, flips)
+                self.set_header(
+                    context, "Scale: %.4f, " % scale_offset + help_string)
+
+            if self.recording:
+                self.recorder.record(perf_counter(), batch, indices)
+
+        else:
+            self.set_header(context, help_string)
 
+        if self.snap_target is not None:
+            self.snap_target_region = Vector(
+                self.projection.view_to_region(self.snap_target))
         else:
-            context.area.header_text_set(help_string)
+            self.snap_target_region = None
 
         # Draw line from the mouse cursor
-        pivot_point_region = view_to_region_vector(
-            region, rv3d, self.camera_orientation, pivot_point)
         self.draw_start = Vector((event.mouse_region_x, event.mouse_region_y))
         # ...to the pivot point (image center or 3D cursor)...
-        self.draw_end = pivot_point_region
+        self.draw_end = session.pivot_point_region
+
+    def nudge(self, context, event):
+        """Move, rotate or scale the images to transform by a step from
+        their current transforms, which are kept in the nudge history"""
+        kind, direction = NUDGE_EVENTS[event.type]
+        if kind == 'SIZE' and self.view_perspective == 'CAMERA':
+            self.report({'WARNING'}, 'Scaling unsupported in camera view.')
+            return
+        batch = self.batch
+        self.nudge_history.append(batch.get_state())
+        self.nudge_future = []
+        self.start_from_current()
+
+        preferences = get_preferences(context)
+        precision = 0.1 if event.shift else 1.0
+        indices = self.get_image_indices()
+        offset = np.zeros(2)
+        angle = 0.0
+        factor = 1.0
+        if kind == 'OFFSET':
+            offset = (np.array(direction) * preferences.nudge_distance
+                      * precision * self.projection.pixel_size)
+        elif kind == 'ROTATION':
+            angle = direction * preferences.nudge_angle * precision
+        else:
+            factor = preferences.nudge_scale ** (direction * precision)
 
-    def modal(self, context, event):
+        if context.space_data.pivot_point == 'INDIVIDUAL_ORIGINS':
+            pivot_point = batch.initial_location_view[indices]
+        else:
+            pivot_point = np.array(self.get_pivot_point(context, indices))
+        locations, rotations, sizes = batch.similarity(
+            indices, pivot_point, angle, factor, offset)
+        batch.write_locations(indices, locations)
+        batch.write_rotations(indices, rotations)
+        batch.write_sizes(indices, sizes)
+        if self.recording:
+            self.recorder.record(perf_counter(), batch, indices)
+        self.refresh(context, event)
+
+    def step_nudges(self, context, event, back=True):
+        """Set the transforms back to those before the last nudge, or
+        forward to those of the last nudge stepped back from"""
+        if back:
+            source, target = self.nudge_history, self.nudge_future
+        else:
+            source, target = self.nudge_future, self.nudge_history
+        if not source:
+            return
+        target.append(self.batch.get_state())
+        self.batch.set_state(source.pop())
+        self.start_from_current()
+        self.refresh(context, event)
+
+    def start_from_current(self):
+        """Stop the current transform, keeping its result, so that the
+        next ones start from the images' current transforms"""
+        self.batch.rebase()
+        self.mode = 'NONE'
+        self.do_draw = False
+        self.numeric_input = NumericInput()
+        self.session = None
+        self.image_grid = None
+
+    def get_proxy(self, i):
+        """Get the proxy of an image, or None if it isn't ready"""
+        future = self.proxy_futures[i]
+        if (future is not None and future.done()
+                and future.exception() is None
+                and future.result() is not None):
+            return bpy.data.images.load(future.result(), check_existing=True)
+        return None
+
+    def show_proxies(self, indices):
+        """Show the proxies of the images being transformed, if they are
+        ready, and the other images' own images. When previewing, proxies
+        are only drawn in the overlay"""
+        proxies = {}
+        for i in indices:
+            proxy = self.get_proxy(i)
+            if proxy is not None:
+                proxies[i] = proxy
+        if self.preview:
+            self.preview_images = [proxies.get(i, image) for i, image
+                                   in enumerate(self.batch.source_images)]
+        else:
+            self.batch.show_images(proxies)
+
+    def refresh(self, context, event):
+        """Update transforms, and request a redraw if what is drawn
+        changed"""
+        self.update(context, event)
+        self.last_event_state = EventState(event)
+        self.pending_event_state = None
+        drawn_state = self.get_drawn_state()
+        if drawn_state != self.drawn_state:
+            self.drawn_state = drawn_state
+            self.tag_redraw(context)
+
+    def get_drawn_state(self):
+        """Get what the view shows of the operator: writes to the images,
+        header, session (images transformed, active image and proxies),
+        pivot line and snap target"""
+        snap_target = self.snap_target_region
+        return (int(self.batch.revisions.sum()), self.header_text,
+                self.session,
+                tuple(self.draw_start) if self.do_draw else None,
+                tuple(snap_target) if snap_target is not None else None)
+
+    def set_header(self, context, text):
+        self.header_text = text
+        context.area.header_text_set(text)
+
+    def tag_redraw(self, context):
         context.area.tag_redraw()
+        for area in self.batch.pop_changed_areas():
+            area.tag_redraw()
+
+    def write_keys(self, context):
+        """Write the recorded transforms as keys from the current frame"""
+        batch = self.batch
+        keys = [get_animation_key(image, background_image.view_axis)
+                for image, background_image in zip(batch.source_images,
+                                                   self.valid_images)]
+
+        # Tolerances of offsets, rotations and sizes, from a distance
+        # in pixels that the images' corners may deviate by
+        indices = self.recorder.indices
+        tolerance = (get_preferences(context).record_tolerance
+                     * self.projection.pixel_size)
+        ratio = batch.ratio[indices]
+        # Corners are this far from centers, per unit of size
+        corner_factor = np.hypot(1.0, 1.0 / ratio)
+        corner_distance = batch.size[indices] * corner_factor
+        tolerances = np.column_stack((
+            np.full(len(indices), tolerance),
+            tolerance * ratio,
+            tolerance / corner_distance,
+            tolerance / corner_factor))
+
+        key_count = write_recorded_keys(context.scene, self.recorder, keys,
+                                        tolerances)
+        self.report({'INFO'}, 'Recorded %i keys from %i samples' % (
+            key_count, self.recorder.length))
+
+    def set_sync_views(self, context, sync_views):
+        """Write transforms to the same images in other 3D Views or not"""
+        self.reset()
+        # Linked views get their own images back before being unlinked,
+        # proxies are shown again on the next update
+        self.batch.show_images({})
+        self.sync_views = sync_views
+        if sync_views:
+            self.batch.link(get_linked_images(context, self.valid_images))
+        else:
+            self.batch.link([()] * len(self.batch))
+
+    def instrument(self):
+        """Record durations of the operator's phases with the profiler,
+        by wrapping the methods they run"""
+        wrap = self.profiler.wrap
+        self.reset = wrap('reset', self.reset)
+        self.get_pivot_point = wrap('pivot', self.get_pivot_point)
+        self.set_header = wrap('header', self.set_header)
+        self.tag_redraw = wrap('redraw', self.tag_redraw)
+        for name in ('snap_translation', 'snap_scale'):
+            setattr(self, name, wrap('math', getattr(self, name)))
+        batch = self.batch
+        for name in ('translate', 'rotate', 'scale', 'similarity'):
+            setattr(batch, name, wrap('math', getattr(batch, name)))
+        batch._write = wrap('rna_writes', batch._write, int)
+
+    def finish(self, context):
+        """Put original images back, remove header, overlay and timer
+        before exiting"""
+        self.batch.show_images({})
+        self.visible_images['in_use'] = False
+        self.overlay.clear()
+        context.area.header_text_set()
+        self.tag_redraw(context)
+        bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+
+    def modal(self, context, event):
+        if self.profiler is None:
+            return self.handle_event(context, event)
+        start = perf_counter()
+        result = self.handle_event(context, event)
+        self.profiler.record('event', start, perf_counter() - start)
+        return result
+
+    def handle_event(self, context, event):
+        # Nudges, but for signs and expressions typed during transforms
+        if (event.value == 'PRESS' and event.type in NUDGE_EVENTS
+                and (self.mode == 'NONE'
+                     or event.type not in NUMERIC_NUDGE_EVENTS)):
+            self.nudge(context, event)
+            return {'RUNNING_MODAL'}
+        if event.type == 'Z' and event.value == 'PRESS' and event.ctrl:
+            self.step_nudges(context, event, back=not event.shift)
+            return {'RUNNING_MODAL'}
+
+        # Numeric input events come first, so that letters can be typed
+        # in expressions
+        if (event.value == 'PRESS'
+                and self.numeric_input.handle_event(event)):
+            self.refresh(context, event)
+            return {'RUNNING_MODAL'}
+
         if event.type in (
                 'MOUSEMOVE',
                 'LEFT_CTRL', 'RIGHT_CTRL',
                 'LEFT_SHIFT', 'RIGHT_SHIFT'):
-            self.update(context, event)
+            # Only update if the mouse or modifiers changed. When an update
+            # rate is set, keep the latest state until the next timer tick,
+            # unless it is back to the last one applied
+            event_state = EventState(event)
+            if self._timer is None:
+                if event_state != self.last_event_state:
+                    self.refresh(context, event_state)
+            elif event_state == self.last_event_state:
+                self.pending_event_state = None
+            else:
+                self.pending_event_state = event_state
+        elif event.type == 'TIMER':
+            if self.pending_event_state is not None:
+                self.refresh(context, self.pending_event_state)
 
         # Axis constraint events
         elif event.type == 'X' and event.value == 'PRESS':
             self.constrain_y = False
             self.constrain_x = not self.constrain_x
-            self.update(context, event)
+            self.refresh(context, event)
         elif event.type == 'Y' and event.value == 'PRESS':
             self.constrain_x = False
             self.constrain_y = not self.constrain_y
-            self.update(context, event)
+            self.refresh(context, event)
+
+        # Align active image onto the image under the mouse
+        elif event.type == 'L' and event.value == 'PRESS':
+            self.align_image(context, event)
+
+        # Snapping to other images
+        elif event.type == 'I' and event.value == 'PRESS':
+            self.snap_to_images = not self.snap_to_images
+            self.refresh(context, event)
+
+        # Recording transforms as keys
+        elif event.type == 'K' and event.value == 'PRESS':
+            self.recording = not self.recording
+            self.recorder.clear()
+            self.refresh(context, event)
+
+        # Syncing the same images in other views
+        elif event.type == 'V' and event.value == 'PRESS':
+            self.set_sync_views(context, not self.sync_views)
+            self.session = None
+            self.refresh(context, event)
 
         if self.mode == 'NONE' and event.type in ('G', 'R', 'S'):
             self.set_initial_view(context, event)
@@ -403,12 +3150,14 @@ Mousewheel to select image"""
         if event.type == 'R' and event.value == 'PRESS':
             self.mode = 'ROTATE'
             self.reset()
-            self.update(context, event)
+            self.session = None
+            self.refresh(context, event)
             self.do_draw = True
         elif event.type == 'G' and event.value == 'PRESS':
             self.mode = 'TRANSLATE'
             self.reset()
-            self.update(context, event)
+            self.session = None
+            self.refresh(context, event)
             # Do not draw stitched line in translation mode
             self.do_draw = False
         elif (
@@ -417,7 +3166,8 @@ Mousewheel to select image"""
             if self.view_perspective == 'ORTHO':
                 self.mode = 'SCALE'
                 self.reset()
-                self.update(context, event)
+                self.session = None
+                self.refresh(context, event)
                 self.do_draw = True
             else:
                 self.report({'WARNING'}, 'Scaling unsupported in camera view.')
@@ -425,72 +3175,59 @@ Mousewheel to select image"""
         # Image selection events: iterate through image list
         elif event.type == 'WHEELUPMOUSE':
             self.reset()
+            self.session = None
             self.active_image += 1
             if self.active_image > len(self.valid_images) - 1:
                 self.active_image = 0
-            self.update(context, event)
+            self.refresh(context, event)
         elif event.type == 'WHEELDOWNMOUSE':
             self.reset()
+            self.session = None
             previous = self.active_image
             self.active_image -= 1
             if previous == 0:
                 self.active_image = len(self.valid_images) - 1
-            self.update(context, event)
+            self.refresh(context, event)
         # Toggle transforming all images
         elif event.type == 'A' and event.value == 'PRESS':
             self.transform_all = not self.transform_all
             self.reset()
-            self.update(context, event)
-
-        # Numeric input selection events
-        elif event.type in EVENT_DIGITS and event.value == 'PRESS':
-            self.numeric_input_string += EVENT_DIGITS[event.type]
-            if self.numeric_input_string.count('.') > 1:
-                self.numeric_input_string = self.numeric_input_string[:-1]
-            self.update(context, event)
-        elif event.type == 'BACK_SPACE' and event.value == 'PRESS':
-            self.numeric_input_string = self.numeric_input_string[:-1]
-            self.update(context, event)
-        elif event.type in ('SLASH', 'NUMPAD_SLASH') and event.value == 'PRESS':
-            self.numeric_input_divide = not self.numeric_input_divide
-            self.update(context, event)
-        elif event.type in ('MINUS', 'NUMPAD_MINUS') and event.value == 'PRESS':
-            self.numeric_input_opposite = not self.numeric_input_opposite
-            self.update(context, event)
-
-        # Confirm and apply
-        elif event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'}:
-            context.area.header_text_set()
-            bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
+            self.session = None
+            self.refresh(context, event)
+
+        # Pick image under the mouse, cycling through overlapping images
+        elif event.type == 'LEFTMOUSE' and event.alt:
+            if event.value == 'PRESS':
+                self.pick_image(context, event)
+
+        # Confirm and apply, on presses only: releasing Alt before the
+        # mouse button after picking an image doesn't confirm
+        elif (event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'}
+                and event.value == 'PRESS'):
+            if self.pending_event_state is not None:
+                self.update(context, self.pending_event_state)
+            # The overlay and timer are removed whatever happens
+            try:
+                if self.recording and self.recorder.length > 1:
+                    self.write_keys(context)
+                self.batch.commit()
+            finally:
+                self.finish(context)
             persistent_settings['active_image'] = self.active_image
             persistent_settings['transform_all'] = self.transform_all
+            persistent_settings['sync_views'] = self.sync_views
             return {'FINISHED'}
 
-        # Cancel and reset
+        # Cancel and reset, nudges included. Nothing is written to the
+        # images when previewing
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
             self.reset()
-            context.area.header_text_set()
-            bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
+            self.batch.set_state(self.original_state)
+            self.finish(context)
             return {'CANCELLED'}
 
         return {'RUNNING_MODAL'}
 
-    def init_images(self, background_images):
-        self.background_images = []
-        for bgi in background_images:
-            i_d = {}
-            i_d['image'] = bgi
-            i_d['image_orientation'] = bgi.view_axis
-            i_d['width'], i_d['height'] = bgi.image.size
-            i_d['initial_flip_x'] = bgi.use_flip_x
-            i_d['initial_flip_y'] = bgi.use_flip_y
-            i_d['initial_location'] = Vector((bgi.offset_x, bgi.offset_y))
-            i_d['initial_location_view'] = Vector((bgi.offset_x, bgi.offset_y))
-            i_d['initial_location_view'].y *= i_d['height'] / i_d['width']
-            i_d['initial_rotation'] = bgi.rotation
-            i_d['initial_size'] = bgi.size
-            self.background_images.append(i_d)
-
     def invoke(self, context, event):
         rv3d = context.region_data
         region = context.region
@@ -499,6 +3236,12 @@ Mousewheel to select image"""
         self.transform_all = persistent_settings['transform_all']
         self.constrain_x = False
         self.constrain_y = False
+        self.snap_to_images = False
+        self.sync_views = False
+        self.recording = False
+        self.recorder = DragRecorder()
+        self.snap_target = None
+        self.snap_target_region = None
 
         if rv3d.view_perspective == 'PERSP':
             self.report({'WARNING'}, 'Perspective camera unsupported.')
@@ -513,31 +3256,71 @@ Mousewheel to select image"""
         self.previous_rotation_offset = 0.0
         self.revolutions = 0
 
-        self.previous_mouse_cp = 1.0
-
-        self.numeric_input_string = ''
-        self.numeric_input_divide = False
-        self.numeric_input_opposite = False
-
-        self.valid_images = []
-        # Get currently visible images
-        for background_image in context.space_data.background_images:
-            image_orientation = background_image.view_axis
-            if (background_image.show_background_image
-                and background_image.image is not None
-                and (rv3d.view_perspective == 'CAMERA'
-                     and image_orientation in {'CAMERA', 'ALL'}
-                     or rv3d.view_perspective == 'ORTHO'
-                     and self.camera_orientation != 'UNDEFINED'
-                     and image_orientation in {self.camera_orientation, 'ALL'}
-                     )):
-                self.valid_images.append(background_image)
+        self.numeric_input = NumericInput()
+
+        self.help_string = self.get_help_string()
+        self.session = None
+
+        preferences = get_preferences(context)
+        self.profiler = profiler if preferences.profile else None
+        start = perf_counter()
+
+        self.visible_images = get_cached_visible_images(
+            context.space_data, rv3d, self.camera_orientation)
+        self.valid_images = self.visible_images['images']
 
         if len(self.valid_images):
             self.active_image = min(
                 persistent_settings['active_image'],
                 len(self.valid_images)-1)
-            self.init_images(self.valid_images)
+            self.batch = BackgroundImageBatch(
+                self.valid_images, camera=self.view_perspective == 'CAMERA',
+                dimensions=self.visible_images['dimensions'],
+                values=read_background_image_values(
+                    context.space_data.background_images,
+                    self.visible_images['indices']))
+            self.visible_images['in_use'] = True
+            # When previewing, transformed images are drawn in the overlay,
+            # and their properties only set on confirm. Not in camera view,
+            # where image extents depend on the camera frame
+            self.preview = (preferences.preview
+                            and self.view_perspective != 'CAMERA')
+            if self.preview:
+                self.batch.defer_writes()
+            self.preview_images = list(self.batch.source_images)
+            # Nudges are undone in the operator, and pushed to Blender's
+            # undo stack as a single step on confirm
+            self.original_state = self.batch.get_state()
+            self.nudge_history = []
+            self.nudge_future = []
+            if self.profiler is not None:
+                self.profiler.record('init_images', start,
+                                     perf_counter() - start,
+                                     len(self.valid_images))
+                self.instrument()
+            if persistent_settings['sync_views']:
+                self.set_sync_views(context, True)
+            self.projection = ViewProjection(context, self.camera_orientation)
+            self.image_grid = None
+            self.overlay = Overlay(self.overlay_backend())
+
+            if preferences.proxy_size:
+                self.proxy_futures = request_proxies(
+                    self.batch.source_images, preferences.proxy_size)
+            else:
+                self.proxy_futures = [None] * len(self.batch)
+
+            self.last_event_state = None
+            self.drawn_state = None
+            self.header_text = None
+            self.pending_event_state = None
+            update_rate = preferences.update_rate
+            if update_rate > 0.0:
+                self._timer = context.window_manager.event_timer_add(
+                    1.0 / update_rate, context.window)
+            else:
+                self._timer = None
+
             context.window_manager.modal_handler_add(self)
             args = (self, context)
             self.do_draw = self.mode in ('ROTATE', 'SCALE')
@@ -548,34 +3331,501 @@ Mousewheel to select image"""
             self.report({'WARNING'}, 'No background image found.')
             return {'CANCELLED'}
 
+    def align_image(self, context, event):
+        """Align the active image onto the image under the mouse"""
+        if self.view_perspective == 'CAMERA':
+            self.report({'WARNING'}, 'Aligning unsupported in camera view.')
+            return
+        if self.image_grid is None:
+            self.image_grid = ImageGrid(self.batch.initial_rectangles())
+
+        candidates = [i for i in self.image_grid.query(
+                          self.projection.region_to_view(
+                              (event.mouse_region_x, event.mouse_region_y)))
+                      .tolist()
+                      if i != self.active_image]
+        if not candidates:
+            self.report({'WARNING'}, 'No reference image under the mouse.')
+            return
+
+        self.reset()
+        self.session = None
+        batch = self.batch
+        rectangles = batch.initial_rectangles()
+
+        def get_image_data(i):
+            # Proxies are smaller than the images themselves
+            image = self.get_proxy(i) or batch.source_images[i]
+            return (get_image_pyramid(image, ALIGN_SIZE),
+                    tuple(array[i] for array in rectangles),
+                    batch.initial_flip[i])
+
+        pivot_point, angle, factor, offset = estimate_alignment(
+            get_image_data(candidates[0]),
+            get_image_data(self.active_image))
+
+        indices = np.array((self.active_image,))
+        locations, rotations, sizes = batch.similarity(
+            indices, pivot_point, angle, factor, offset)
+        batch.write_locations(indices, locations)
+        batch.write_rotations(indices, rotations)
+        batch.write_sizes(indices, sizes)
+
+        # Stop the current transform, so that the next ones start from
+        # the alignment instead of undoing it
+        self.start_from_current()
+        self.refresh(context, event)
+        self.report({'INFO'}, 'Aligned onto %s: Rot: %.2f°, Scale: %.4f' % (
+            batch.source_images[candidates[0]].name, degrees(angle), factor))
+
+    def pick_image(self, context, event):
+        """Make the image under the mouse active"""
+        if self.view_perspective == 'CAMERA':
+            self.report({'WARNING'}, 'Picking unsupported in camera view.')
+            return
+        if self.image_grid is None:
+            self.image_grid = ImageGrid(self.batch.initial_rectangles())
+
+        candidates = self.image_grid.query(self.projection.region_to_view(
+            (event.mouse_region_x, event.mouse_region_y))).tolist()
+        if not candidates:
+            return
+        if self.active_image in candidates:
+            picked = candidates[
+                (candidates.index(self.active_image) + 1) % len(candidates)]
+        else:
+            picked = candidates[0]
+
+        self.reset()
+        self.session = None
+        self.active_image = picked
+        self.refresh(context, event)
+
     def set_initial_view(self, context, event):
-        rv3d = context.region_data
-        region = context.region
         self.initial_mouse = Vector((
             event.mouse_region_x,
             event.mouse_region_y))
-        self.initial_mouse_location_3d = (
-            view3d_utils.region_2d_to_location_3d(
-                region, rv3d, self.initial_mouse, Vector()))
-
-        self.initial_mouse_location_2d = (
-            space_to_view_vector(
-                self.camera_orientation,
-                self.initial_mouse_location_3d))
+        self.initial_mouse_location_2d = Vector(
+            self.projection.region_to_view(self.initial_mouse))
 
         self.draw_start = self.initial_mouse
         self.draw_end = self.initial_mouse
+        self.session = None
+
+
+class BackgroundImageBulkTransform(bpy.types.Operator):
+    """Move, rotate and scale background images by given values"""
+    bl_idname = "view3d.background_image_bulk_transform"
+    bl_label = "Transform Background Images by Values"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    offset = FloatVectorProperty(
+        name="Offset", size=2,
+        description="Translation in view space")
+    rotation = FloatProperty(
+        name="Rotation", subtype='ANGLE',
+        description="Clockwise rotation around the pivot point")
+    scale = FloatProperty(
+        name="Scale", default=1.0,
+        description="Scale around the pivot point, negative to flip")
+    selection = EnumProperty(
+        name="Images",
+        items=(('VISIBLE', "Visible", "All images shown in the view"),
+               ('ACTIVE', "Active",
+                "The image last transformed interactively")),
+        default='VISIBLE')
+    pivot_point = EnumProperty(
+        name="Pivot Point",
+        items=(('BOUNDING_BOX_CENTER', "Bounding Box Center", ""),
+               ('CURSOR', "3D Cursor", ""),
+               ('INDIVIDUAL_ORIGINS', "Individual Origins", ""),
+               ('MEDIAN_POINT', "Median Point", ""),
+               ('ACTIVE_ELEMENT', "Active Element", "")),
+        default='MEDIAN_POINT')
+
+    @classmethod
+    def poll(self, context):
+        return (context.space_data.type == 'VIEW_3D'
+                and len(context.space_data.background_images))
+
+    def invoke(self, context, event):
+        self.pivot_point = context.space_data.pivot_point
+        return self.execute(context)
+
+    def execute(self, context):
+        rv3d = context.region_data
+        if rv3d.view_perspective == 'PERSP':
+            self.report({'WARNING'}, 'Perspective camera unsupported.')
+            return {'CANCELLED'}
+        orientation = get_view_orientation_from_quaternion(rv3d.view_rotation)
+        images = get_visible_images(context.space_data, rv3d, orientation)
+        if not images:
+            self.report({'WARNING'}, 'No background image found.')
+            return {'CANCELLED'}
+
+        active_image = min(persistent_settings['active_image'],
+                           len(images) - 1)
+        if self.selection == 'ACTIVE':
+            images = [images[active_image]]
+            active_image = 0
+
+        projection = ViewProjection(context, orientation)
+        transform_background_images(
+            images, self.offset, self.rotation, self.scale,
+            pivot_point=self.pivot_point,
+            cursor=projection.world_to_view(
+                context.space_data.cursor_location),
+            active_image=active_image,
+            camera=rv3d.view_perspective == 'CAMERA')
+        return {'FINISHED'}
+
+
+class BackgroundImageLayout(bpy.types.Operator):
+    """Align, distribute, arrange in a grid or pack background images"""
+    bl_idname = "view3d.background_image_layout"
+    bl_label = "Lay Out Background Images"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mode = EnumProperty(
+        name="Layout",
+        items=(('ALIGN', "Align", "Align the images' edges or centers"),
+               ('DISTRIBUTE', "Distribute", "Space the images evenly"),
+               ('GRID', "Grid", "Arrange the images in a grid"),
+               ('PACK', "Pack", "Pack the images without overlap")),
+        default='GRID')
+    axis = EnumProperty(
+        name="Axis",
+        items=(('X', "X", ""), ('Y', "Y", "")),
+        default='X')
+    edge = EnumProperty(
+        name="Edge",
+        items=(('MIN', "Left/Bottom", ""),
+               ('CENTER', "Center", ""),
+               ('MAX', "Right/Top", "")),
+        default='MIN')
+    relative_to = EnumProperty(
+        name="Relative To",
+        items=(('SELECTION', "Selection", "Edge of all the images"),
+               ('ACTIVE', "Active",
+                "Edge of the image last transformed interactively")),
+        default='SELECTION')
+    columns = IntProperty(
+        name="Columns",
+        description="Number of grid columns, 0 for a square grid",
+        default=0, min=0, soft_max=100)
+    order = EnumProperty(
+        name="Order",
+        items=(('POSITION', "Position", "Rows from top to bottom"),
+               ('NAME', "Name", "Image names")),
+        default='POSITION')
+    spacing = FloatProperty(
+        name="Spacing",
+        description="Gap between grid cells or packed images, in view space",
+        default=0.0, min=0.0, soft_max=10.0)
+
+    @classmethod
+    def poll(self, context):
+        return (context.space_data.type == 'VIEW_3D'
+                and len(context.space_data.background_images))
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "mode")
+        if self.mode in ('ALIGN', 'DISTRIBUTE'):
+            layout.row().prop(self, "axis", expand=True)
+        if self.mode == 'ALIGN':
+            layout.prop(self, "edge")
+            layout.prop(self, "relative_to")
+        elif self.mode == 'GRID':
+            layout.prop(self, "columns")
+            layout.prop(self, "order")
+        if self.mode in ('GRID', 'PACK'):
+            layout.prop(self, "spacing")
+
+    def execute(self, context):
+        rv3d = context.region_data
+        if rv3d.view_perspective == 'PERSP':
+            self.report({'WARNING'}, 'Perspective camera unsupported.')
+            return {'CANCELLED'}
+        orientation = get_view_orientation_from_quaternion(rv3d.view_rotation)
+        images = get_visible_images(context.space_data, rv3d, orientation)
+        if not images:
+            self.report({'WARNING'}, 'No background image found.')
+            return {'CANCELLED'}
+
+        layout_background_images(
+            images, self.mode, self.axis, self.edge, self.columns,
+            self.spacing, self.order, self.relative_to,
+            active_image=min(persistent_settings['active_image'],
+                             len(images) - 1),
+            camera=rv3d.view_perspective == 'CAMERA')
+        return {'FINISHED'}
+
+
+class BackgroundImageStabilize(bpy.types.Operator):
+    """Key the offsets of the active image sequence at each of its frames,
+    so that its contents stay where they are at the current frame"""
+    bl_idname = "view3d.background_image_stabilize"
+    bl_label = "Stabilize Background Image Sequence"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    rotation = BoolProperty(
+        name="Rotation",
+        description="Also stabilize rotation, keying rotations",
+        default=False)
+    size = IntProperty(
+        name="Resolution",
+        description="Largest dimension of the frames compared",
+        default=256, min=32, soft_max=1024, subtype='PIXEL')
+
+    @classmethod
+    def poll(self, context):
+        return (context.space_data.type == 'VIEW_3D'
+                and len(context.space_data.background_images))
+
+    def execute(self, context):
+        rv3d = context.region_data
+        if rv3d.view_perspective != 'ORTHO':
+            self.report({'WARNING'}, 'Stabilizing only supported in '
+                                     'ortho views.')
+            return {'CANCELLED'}
+        orientation = get_view_orientation_from_quaternion(rv3d.view_rotation)
+        images = get_visible_images(context.space_data, rv3d, orientation)
+        if not images:
+            self.report({'WARNING'}, 'No background image found.')
+            return {'CANCELLED'}
+        background_image = images[min(persistent_settings['active_image'],
+                                      len(images) - 1)]
+        if background_image.image.source != 'SEQUENCE':
+            self.report({'WARNING'}, 'Active image is not an image sequence.')
+            return {'CANCELLED'}
+
+        frame_count = stabilize_background_image(
+            context.scene, background_image, self.rotation, self.size)
+        if not frame_count:
+            self.report({'WARNING'}, 'No frame could be stabilized.')
+            return {'CANCELLED'}
+        apply_recorded_keys(context.scene)
+        self.report({'INFO'}, 'Stabilized %i frames' % frame_count)
+        return {'FINISHED'}
+
+
+class BackgroundImageTransformPreferences(bpy.types.AddonPreferences):
+    bl_idname = __name__
+
+    update_rate = FloatProperty(
+        name="Update Rate",
+        description="Maximum number of transform updates per second while "
+                    "moving the mouse. 0 to update on every event",
+        default=60.0, min=0.0, soft_max=240.0)
+    proxy_size = IntProperty(
+        name="Proxy Size",
+        description="Largest dimension of the low resolution images shown "
+                    "while transforming. 0 to show the images themselves",
+        default=1024, min=0, soft_max=4096, subtype='PIXEL')
+    record_tolerance = FloatProperty(
+        name="Record Tolerance",
+        description="Largest distance, in pixels, between the images' "
+                    "recorded transforms and the keys simplifying them",
+        default=2.0, min=0.0, soft_max=10.0, subtype='PIXEL')
+    nudge_distance = FloatProperty(
+        name="Nudge Distance",
+        description="Distance, in pixels, images are moved by with the "
+                    "arrow keys. Ten times less with Shift",
+        default=10.0, min=0.0, soft_max=100.0, subtype='PIXEL')
+    nudge_angle = FloatProperty(
+        name="Nudge Angle",
+        description="Angle images are rotated by with [ and ]. "
+                    "Ten times less with Shift",
+        default=radians(1.0), min=0.0, soft_max=radians(45.0),
+        subtype='ANGLE')
+    nudge_scale = FloatProperty(
+        name="Nudge Scale",
+        description="Factor images are scaled by with + and -. "
+                    "Ten times finer with Shift",
+        default=1.01, min=1.0, soft_max=2.0)
+    preview = BoolProperty(
+        name="Preview",
+        description="Draw transformed images over the view, and only set "
+                    "their properties when confirming",
+        default=False)
+    profile = BoolProperty(
+        name="Profile",
+        description="Record durations of the transform operator's phases, "
+                    "summarized in the Background Images panel",
+        default=False)
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "update_rate")
+        layout.prop(self, "proxy_size")
+        layout.prop(self, "record_tolerance")
+        layout.prop(self, "nudge_distance")
+        layout.prop(self, "nudge_angle")
+        layout.prop(self, "nudge_scale")
+        layout.prop(self, "preview")
+        layout.prop(self, "profile")
+
+
+def get_preferences(context):
+    return context.user_preferences.addons[__name__].preferences
+
+
+class BackgroundImageTransformExportProfile(bpy.types.Operator,
+                                           ExportHelper):
+    """Export durations recorded while transforming background images"""
+    bl_idname = "view3d.background_image_transform_export_profile"
+    bl_label = "Export Transform Profile"
+
+    filename_ext = ".json"
+    filter_glob = StringProperty(default="*.json", options={'HIDDEN'})
+
+    @classmethod
+    def poll(self, context):
+        return profiler.length > 0
+
+    def execute(self, context):
+        profiler.export(self.filepath)
+        return {'FINISHED'}
+
+
+class BackgroundImageClearKeys(bpy.types.Operator):
+    """Remove the keys recorded on background images in this scene"""
+    bl_idname = "view3d.background_image_clear_keys"
+    bl_label = "Clear Recorded Keys"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(self, context):
+        return ANIMATION_KEY in context.scene
+
+    def execute(self, context):
+        del context.scene[ANIMATION_KEY]
+        return {'FINISHED'}
+
+
+class BackgroundImageLayoutSave(bpy.types.Operator):
+    """Save the layout of the view's background images in the scene"""
+    bl_idname = "view3d.background_image_layout_save"
+    bl_label = "Save Layout"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    name = StringProperty(name="Name", default="Layout")
+
+    @classmethod
+    def poll(self, context):
+        return (context.space_data.type == 'VIEW_3D'
+                and len(context.space_data.background_images))
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        save_layout(context.scene, get_view_key(context), self.name,
+                    context.space_data.background_images)
+        return {'FINISHED'}
+
+
+class BackgroundImageLayoutRestore(bpy.types.Operator):
+    """Set the view's background images to a saved layout"""
+    bl_idname = "view3d.background_image_layout_restore"
+    bl_label = "Restore Layout"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    name = StringProperty(name="Name")
+
+    @classmethod
+    def poll(self, context):
+        return (context.space_data.type == 'VIEW_3D'
+                and LAYOUTS_KEY in context.scene)
+
+    def execute(self, context):
+        view = get_view_key(context)
+        layouts = get_layouts(context.scene, view)['layouts']
+        if self.name not in layouts:
+            self.report({'WARNING'}, 'No layout named %s in this view.'
+                        % self.name)
+            return {'CANCELLED'}
+        background_images = context.space_data.background_images
+        if layouts[self.name]['count'] != len(background_images):
+            self.report({'WARNING'}, 'Layout saved with %i images, '
+                        'restoring by position.'
+                        % layouts[self.name]['count'])
+        restore_layout(context.scene, view, self.name, background_images)
+        context.area.tag_redraw()
+        return {'FINISHED'}
+
+
+class BackgroundImageLayoutDelete(bpy.types.Operator):
+    """Remove a saved layout of background images"""
+    bl_idname = "view3d.background_image_layout_delete"
+    bl_label = "Delete Layout"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    name = StringProperty(name="Name")
+
+    @classmethod
+    def poll(self, context):
+        return LAYOUTS_KEY in context.scene
+
+    def execute(self, context):
+        view = get_view_key(context)
+        if self.name not in get_layouts(context.scene, view)['layouts']:
+            return {'CANCELLED'}
+        delete_layout(context.scene, view, self.name)
+        return {'FINISHED'}
+
 
 def background_image_transform_panel(self, context):
+    # Images and axes are edited in this panel
+    check_visible_images(context.space_data)
     layout = self.layout
     layout.operator("view3d.background_image_transform")
+    layout.operator("view3d.background_image_bulk_transform")
+    layout.operator(BackgroundImageLayout.bl_idname)
+    layout.operator(BackgroundImageStabilize.bl_idname)
+    if ANIMATION_KEY in context.scene:
+        layout.operator(BackgroundImageClearKeys.bl_idname)
+
+    layout.operator(BackgroundImageLayoutSave.bl_idname)
+    if LAYOUTS_KEY in context.scene:
+        layouts = get_layouts(context.scene, get_view_key(context))
+        for name in sorted(layouts['layouts'].keys()):
+            row = layout.row(align=True)
+            row.operator(BackgroundImageLayoutRestore.bl_idname,
+                         text=name).name = name
+            row.operator(BackgroundImageLayoutDelete.bl_idname,
+                         text="", icon='X').name = name
+
+    if get_preferences(context).profile and profiler.length:
+        box = layout.box()
+        for phase, stats in sorted(profiler.get_summary().items(),
+                                   key=lambda item: -item[1]['mean_ms']):
+            box.label(text="%s: %.3f ms (max %.3f), %i calls, %i count" % (
+                phase, stats['mean_ms'], stats['max_ms'],
+                stats['calls'], stats['count']))
+        box.operator(BackgroundImageTransformExportProfile.bl_idname)
 
 
 addon_keymaps = []
 
 
 def register():
+    bpy.utils.register_class(BackgroundImageTransformPreferences)
     bpy.utils.register_class(BackgroundImageTransform)
+    bpy.utils.register_class(BackgroundImageBulkTransform)
+    bpy.utils.register_class(BackgroundImageLayout)
+    bpy.utils.register_class(BackgroundImageStabilize)
+    bpy.utils.register_class(BackgroundImageClearKeys)
+    bpy.utils.register_class(BackgroundImageLayoutSave)
+    bpy.utils.register_class(BackgroundImageLayoutRestore)
+    bpy.utils.register_class(BackgroundImageLayoutDelete)
+    bpy.app.handlers.frame_change_post.append(apply_recorded_keys)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post,
+                     bpy.app.handlers.redo_post):
+        handlers.append(clear_visible_images)
+    bpy.app.handlers.scene_update_post.append(check_updated_images)
+    bpy.utils.register_class(BackgroundImageTransformExportProfile)
     bpy.types.VIEW3D_PT_background_image.append(
         background_image_transform_panel)
 
@@ -588,7 +3838,26 @@ def register():
 
 
 def unregister():
+    global proxy_executor
+    if proxy_executor is not None:
+        proxy_executor.shutdown(wait=False)
+        proxy_executor = None
+    bpy.utils.unregister_class(BackgroundImageTransformExportProfile)
+    bpy.app.handlers.frame_change_post.remove(apply_recorded_keys)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post,
+                     bpy.app.handlers.redo_post):
+        handlers.remove(clear_visible_images)
+    bpy.app.handlers.scene_update_post.remove(check_updated_images)
+    visible_image_cache.clear()
+    bpy.utils.unregister_class(BackgroundImageLayoutDelete)
+    bpy.utils.unregister_class(BackgroundImageLayoutRestore)
+    bpy.utils.unregister_class(BackgroundImageLayoutSave)
+    bpy.utils.unregister_class(BackgroundImageClearKeys)
+    bpy.utils.unregister_class(BackgroundImageStabilize)
+    bpy.utils.unregister_class(BackgroundImageLayout)
+    bpy.utils.unregister_class(BackgroundImageBulkTransform)
     bpy.utils.unregister_class(BackgroundImageTransform)
+    bpy.utils.unregister_class(BackgroundImageTransformPreferences)
     bpy.types.VIEW3D_PT_background_image.remove(
         background_image_transform_panel)
 